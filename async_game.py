@@ -0,0 +1,120 @@
+"""This module provides an asyncio based engine running the same states as game.Game on one event loop"""
+import asyncio
+import random
+import time
+
+from conditions import all_fulfilled
+from helpers import kick_out_atom, blink_randomly, blink_alternating, blink_together,\
+    async_kick_out_atom, async_blink_randomly, async_blink_alternating, async_blink_together
+
+# Blocking actions used in level tables and the coroutines replacing them on the event loop
+async_actions = {time.sleep: asyncio.sleep,
+                 kick_out_atom: async_kick_out_atom,
+                 blink_randomly: async_blink_randomly,
+                 blink_alternating: async_blink_alternating,
+                 blink_together: async_blink_together}
+
+
+async def run_action(action, params):
+    if not isinstance(params, tuple):
+        params = (params,)
+    coroutine_action = async_actions.get(action)
+    if coroutine_action is not None:
+        await coroutine_action(*params)
+    else:
+        # Everything else is expected to return quickly, e.g. cavity_resonant_blinking
+        action(*params)
+
+
+class AsyncGame:
+    def __init__(self, states, wiring=None, sound=None, poll_interval=0.1, wiring_interval=0.01,
+                 parallel_interval=0.01, rng=random):
+        self.states = states
+        self.rng = rng
+        self.wiring = wiring
+        self.sound = sound
+        self.poll_interval = poll_interval
+        self.wiring_interval = wiring_interval
+        self.parallel_interval = parallel_interval
+        self.current_state = None
+
+    def run(self, start_state=0):
+        asyncio.run(self.event_loop(start_state))
+
+    async def event_loop(self, start_state=0):
+        wiring_task = None
+        if self.wiring is not None:
+            wiring_task = asyncio.ensure_future(self.wiring_loop())
+        next_state = start_state
+        try:
+            while True:
+                next_state = await self.run_state(self.states[next_state])
+        finally:
+            if wiring_task is not None:
+                wiring_task.cancel()
+
+    async def wiring_loop(self):
+        while True:
+            self.wiring()
+            await asyncio.sleep(self.wiring_interval)
+
+    async def run_state(self, state):
+        self.current_state = state
+        sound_task = self.enter(state)
+        tasks = [asyncio.ensure_future(self.run_parallel(state))]
+        if sound_task is not None:
+            tasks.append(sound_task)
+        try:
+            while True:
+                if all_fulfilled(state.conditions):
+                    self.leave(state)
+                    return state.next_states[0]
+                if self.rng.random() < state.fail_probability:
+                    for action, params in state.random_actions:
+                        await run_action(action, params)
+                    self.leave(state)
+                    return state.next_states[1]
+                await asyncio.sleep(self.next_poll_delay(state))
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def next_poll_delay(self, state):
+        # Wake up right when a hold_true window expires instead of up to one poll later
+        delay = self.poll_interval
+        for condition in state.conditions:
+            if hasattr(condition, 'time_until_hold'):
+                hold_timeout = condition.time_until_hold()
+                if hold_timeout is not None:
+                    delay = min(delay, hold_timeout + 0.001)
+        return delay
+
+    def enter(self, state):
+        sound_task = None
+        if self.sound is not None:
+            self.sound.play_stage_sound(state.next_states[0] - 1)
+            if state.next_states[1] != 99:
+                sound_task = asyncio.ensure_future(self.random_sound_loop())
+        for action, params in state.enter_actions:
+            action(params)
+        return sound_task
+
+    def leave(self, state):
+        if self.sound is not None:
+            self.sound.stop_sound_loop()
+        for action, params in state.leave_actions:
+            action(params)
+
+    async def run_parallel(self, state):
+        while True:
+            for action, params in state.parallel_actions:
+                await run_action(action, params)
+            # Non blocking actions would otherwise starve the event loop
+            await asyncio.sleep(self.parallel_interval)
+
+    async def random_sound_loop(self):
+        await asyncio.sleep(10)
+        while True:
+            self.sound.queue_random_sound()
+            await asyncio.sleep(30)
@@ -0,0 +1,157 @@
+"""This module runs many simulated games in parallel processes to tune thresholds and fail_probability"""
+import copy
+import random
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from conditions import AnalogCondition, DigitalCondition, CompiledCondition, ABOVE, BELOW, WITHIN, IS
+from simulation import Simulation
+
+
+def default_level_table():
+    from levels import load_levels
+    return load_levels('levels.json').build_states()
+
+
+class SeekingPlayer:
+    """Player model which turns the knob of the current level towards a value fulfilling it.
+
+    After a reaction time it moves with limited speed and shaky hands, so equal conditions with a small
+    epsilon take longer to hold than wide ones. The shaking is a slowly drifting offset of about noise.
+    """
+    def __init__(self, reaction_time=(1.0, 4.0), speed=0.2, noise=0.02, tremor_time=1.0, margin=0.05):
+        self.reaction_time = reaction_time
+        self.speed = speed
+        self.noise = noise
+        self.tremor_time = tremor_time
+        self.margin = margin
+        self._state_key = None
+        self._act_at = 0.0
+        self._positions = {}
+        self._tremor = 0.0
+
+    def targets(self, condition):
+        """(input, value, digital) triples which fulfill the condition, digital inputs are switched directly"""
+        if isinstance(condition, AnalogCondition):
+            if condition.operator[1] == '>':
+                return [(condition.adc, condition.threshold + self.margin, False)]
+            if condition.operator[1] == '<':
+                return [(condition.adc, condition.threshold - self.margin, False)]
+            return [(condition.adc, condition.threshold, False)]
+        if isinstance(condition, DigitalCondition):
+            return [(condition.switch, bool(condition.fullfilled_if_on), True)]
+        if isinstance(condition, CompiledCondition):
+            # Only aims at the plain leaves, negated parts of an expression are ignored
+            targets = []
+            for instruction in condition.program:
+                if instruction[0] == ABOVE:
+                    targets.append((instruction[1], instruction[2] + self.margin, False))
+                elif instruction[0] == BELOW:
+                    targets.append((instruction[1], instruction[2] - self.margin, False))
+                elif instruction[0] == WITHIN:
+                    targets.append((instruction[1], instruction[2], False))
+                elif instruction[0] == IS:
+                    targets.append((instruction[1], bool(instruction[2]), True))
+            return targets
+        return []
+
+    def __call__(self, simulation, state_key, state):
+        now = simulation.clock.time()
+        if state_key != self._state_key:
+            self._state_key = state_key
+            self._act_at = now + simulation.rng.uniform(*self.reaction_time)
+        if now < self._act_at:
+            return
+        # Ornstein-Uhlenbeck tremor, correlated over tremor_time with a standard deviation of noise
+        decay = simulation.tick / self.tremor_time
+        self._tremor += -decay * self._tremor + self.noise * (2.0 * decay) ** 0.5 * simulation.rng.gauss(0.0, 1.0)
+        for condition in state.conditions:
+            for simulated_input, target, digital in self.targets(condition):
+                if digital:
+                    simulated_input.set(target)
+                    continue
+                position = self._positions.get(simulated_input.pin, simulated_input.value)
+                step = self.speed * simulation.tick
+                position += max(-step, min(step, target - position))
+                self._positions[simulated_input.pin] = position
+                simulated_input.set(position + self._tremor)
+
+
+_level_table = None
+
+
+def _init_worker(level_factory):
+    global _level_table
+    _level_table = level_factory()
+
+
+def run_games(seeds, player, max_time):
+    results = []
+    for seed in seeds:
+        simulation = Simulation(_level_table, seed=seed, driver=copy.deepcopy(player))
+        log = simulation.run(max_time=max_time)
+        level_times = defaultdict(float)
+        for state_key, seconds in simulation.state_times:
+            level_times[state_key] += seconds
+        results.append({'seed': seed,
+                        'completed': simulation.is_final(simulation.states[log[-1].to_state]) if log else False,
+                        'time': log[-1].time if log else max_time,
+                        'level_times': dict(level_times),
+                        'bounces': sum(1 for transition in log if transition.reason == 'random')})
+    return results
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(values):
+    return {'count': len(values),
+            'mean': sum(values) / len(values) if values else 0.0,
+            'p50': percentile(values, 0.5),
+            'p90': percentile(values, 0.9),
+            'max': max(values) if values else 0.0}
+
+
+def run_batch(level_factory=default_level_table, games=1000, seed=0, player=None, workers=None, max_time=600.0,
+              chunk_size=50):
+    """Runs games simulated games on a process pool, the same seed always gives the same report"""
+    player = SeekingPlayer() if player is None else player
+    seed_generator = random.Random(seed)
+    seeds = [seed_generator.randrange(2 ** 32) for _ in range(games)]
+    chunks = [seeds[start:start + chunk_size] for start in range(0, games, chunk_size)]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(level_factory,)) as executor:
+        futures = [executor.submit(run_games, chunk, player, max_time) for chunk in chunks]
+        for future in futures:
+            results.extend(future.result())
+    return report(results)
+
+
+def report(results):
+    level_times = defaultdict(list)
+    for result in results:
+        for state_key, seconds in result['level_times'].items():
+            level_times[state_key].append(seconds)
+    return {'games': len(results),
+            'completed': sum(1 for result in results if result['completed']),
+            'completion_time': summarize([result['time'] for result in results if result['completed']]),
+            'level_time': {state_key: summarize(times) for state_key, times in sorted(level_times.items())},
+            'bounces': summarize([result['bounces'] for result in results])}
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Simulate many games to tune the level table')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-time', type=float, default=600.0)
+    args = parser.parse_args()
+    print(json.dumps(run_batch(games=args.games, seed=args.seed, workers=args.workers, max_time=args.max_time),
+                     indent=2))
@@ -0,0 +1,142 @@
+"""This module benchmarks the hardware abstraction and condition hot paths on the mock backend.
+
+    python benchmark.py --save       stores the results as baseline in benchmark_baseline.json
+    python benchmark.py              compares against the baseline and fails on regressions
+"""
+import argparse
+import json
+import sys
+import time
+import timeit
+
+from hardware import ADC, LED, Servo
+from conditions import AnalogCondition
+from helpers import cavity_resonant_blinking
+from mock_backend import shared_backend
+from sampler import ADCSampler
+from telemetry import telemetry
+
+
+def best_time_per_call(function, number, repeat=5):
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def bench_adc_value():
+    adc = ADC('AIN1', mock_hardware=True)
+    return best_time_per_call(lambda: adc.value, 10000)
+
+
+def bench_adc_value_averaged():
+    adc = ADC('AIN4', mock_hardware=True, average_samples=100)
+    return best_time_per_call(lambda: adc.value, 200)
+
+
+def bench_adc_value_sampled():
+    sampler = ADCSampler()
+    adc = ADC('AIN4', mock_hardware=True, average_samples=100, sampler=sampler)
+    sampler.sample_once()
+    return best_time_per_call(lambda: adc.value, 10000)
+
+
+def bench_analog_condition():
+    condition = AnalogCondition(ADC('AIN1', mock_hardware=True), threshold=0.7, condition='equal',
+                                equal_epsilon=0.03, hold_true=3.0)
+    return best_time_per_call(lambda: bool(condition), 10000)
+
+
+def bench_cavity_resonant_blinking():
+    adc = ADC('AIN1', mock_hardware=True)
+    led_0, led_1 = LED('P9_23', mock_hardware=True), LED('P9_15', mock_hardware=True)
+    return best_time_per_call(lambda: cavity_resonant_blinking(led_0, led_1, adc), 10000)
+
+
+def bench_servo_angle():
+    servo = Servo('P8_13', mock_hardware=True)
+    angles = [0.2, 0.8]
+
+    def move():
+        angles.reverse()
+        servo.angle = angles[0]
+    return best_time_per_call(move, 10000)
+
+
+class SilentSound:
+    """Stands in for the sound server, the transition benchmark must not need the sound folder or aplay"""
+    def play_stage_sound(self, stagenumber):
+        pass
+
+    def start_random_sound_loop(self):
+        pass
+
+    def stop_sound_loop(self):
+        pass
+
+    def clear_sound_loop(self):
+        pass
+
+
+def bench_state_transition():
+    from game import State
+    State.sound = SilentSound()
+    condition = AnalogCondition(ADC('AIN1', mock_hardware=True), threshold=-1.0)
+    state = State('Benchmark', condition, enter_actions=[], leave_actions=[], parallel_actions=[],
+                  next_states=[0, 99])
+    return best_time_per_call(state.run, 50)
+
+
+benchmarks = {'adc_value': bench_adc_value,
+              'adc_value_averaged_100': bench_adc_value_averaged,
+              'adc_value_sampled_100': bench_adc_value_sampled,
+              'analog_condition': bench_analog_condition,
+              'cavity_resonant_blinking': bench_cavity_resonant_blinking,
+              'servo_angle': bench_servo_angle,
+              'state_transition': bench_state_transition}
+
+
+def run(selected=None):
+    # Diagnostics would only measure the telemetry ring
+    telemetry.enabled = False
+    shared_backend().write('AIN1', 0.7)
+    shared_backend().write('AIN4', 0.3)
+    results = {}
+    for name, benchmark in benchmarks.items():
+        if selected and name not in selected:
+            continue
+        results[name] = benchmark()
+        print('%-28s %10.2f us' % (name, results[name] * 1e6))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, seconds in sorted(results.items()):
+        if name not in baseline:
+            continue
+        ratio = seconds / baseline[name]
+        marker = 'REGRESSION' if ratio > 1.0 + tolerance else ''
+        print('%-28s %6.2fx baseline %s' % (name, ratio, marker))
+        if marker:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths against a stored baseline')
+    parser.add_argument('names', nargs='*', help='only run these benchmarks')
+    parser.add_argument('--baseline', default='benchmark_baseline.json')
+    parser.add_argument('--save', action='store_true', help='store the results as new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown, 0.2 means 20 %%')
+    args = parser.parse_args()
+
+    results = run(args.names)
+    if args.save:
+        with open(args.baseline, 'w') as fh:
+            json.dump({'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}, fh, indent=2)
+        sys.exit(0)
+    try:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)['results']
+    except IOError:
+        print('No baseline in %s, run with --save first' % args.baseline)
+        sys.exit(0)
+    sys.exit(1 if compare(results, baseline, args.tolerance) else 0)
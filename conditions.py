@@ -2,6 +2,8 @@
 import time
 import operator as op
 
+from telemetry import telemetry
+
 
 class DigitalCondition:
     def __init__(self, switch, fullfilled_if_on=True, debug=False):
@@ -9,20 +11,29 @@ class DigitalCondition:
         self.debug = debug
         self.fullfilled_if_on = fullfilled_if_on
 
+    @property
+    def devices(self):
+        return [self.switch]
+
+    def evaluate(self, snapshot):
+        switch_state = snapshot[self.switch]
+        return bool(switch_state) if self.fullfilled_if_on else not switch_state
+
     def __bool__(self):
-        switch_state = self.switch.value
-        return switch_state if self.fullfilled_if_on else not switch_state
+        return self.evaluate({self.switch: self.switch.value})
 
 
 class AnalogCondition:
     comparison_operators = {'bigger': [op.gt, '>'], 'smaller': [op.lt, '<'], 'equal': [op.eq, '==']}
 
-    def __init__(self, adc, threshold=0.0, equal_epsilon=0.01, condition='bigger', debug=False, hold_true=None):
+    def __init__(self, adc, threshold=0.0, equal_epsilon=0.01, condition='bigger', debug=False, hold_true=None,
+                 clock=time.time):
         self.adc = adc
         self.threshold = threshold
         self.debug = debug
         self.hold_true = hold_true
-        self._start_true_time = 0.0
+        self.clock = clock
+        self._start_true_time = None
         self.timed_condition = False
         self.equal_epsilon = equal_epsilon
         try:
@@ -30,8 +41,15 @@ class AnalogCondition:
         except IndexError:
             raise IndexError('Provide one of the following strings: bigger, smaller, equal')
 
+    @property
+    def devices(self):
+        return [self.adc]
+
     def __bool__(self):
-        reading = self.adc.value
+        return self.evaluate({self.adc: self.adc.value})
+
+    def evaluate(self, snapshot):
+        reading = snapshot[self.adc]
         if self.operator[0] is op.eq:
             condition_fulfilled = True if (abs(reading - self.threshold) < self.equal_epsilon) else False
         else:
@@ -39,28 +57,227 @@ class AnalogCondition:
         if self.hold_true:
             if condition_fulfilled:
                 if not self.timed_condition:
-                    if self._start_true_time == 0.0:
-                        self._start_true_time = time.time()
+                    if self._start_true_time is None:
+                        self._start_true_time = self.clock()
                     else:
-                        if (time.time() - self._start_true_time) > self.hold_true:
-                            self._start_true_time = 0.0
+                        if (self.clock() - self._start_true_time) > self.hold_true:
+                            self._start_true_time = None
                             self.timed_condition = True
                         else:
                             self.timed_condition = False
             else:
                 self.timed_condition = False
-                self._start_true_time = 0.0
+                self._start_true_time = None
         else:
             self.timed_condition = condition_fulfilled
 
         if self.debug:
-            print('{:.4f} {} {:.4f} -> {}'.format(reading, self.operator[1], self.threshold, condition_fulfilled))
+            telemetry.event('condition', pin=getattr(self.adc, 'pin', None), reading=reading,
+                            operator=self.operator[1], threshold=self.threshold, fulfilled=condition_fulfilled)
         return self.timed_condition
 
+    def time_until_hold(self):
+        """Seconds until a running hold_true window expires, None if no window is running"""
+        if not self.hold_true or self._start_true_time is None:
+            return None
+        return max(0.0, self.hold_true - (self.clock() - self._start_true_time))
+
+    def reset(self):
+        self._start_true_time = None
+        self.timed_condition = False
+
+    @property
+    def fulfilled(self):
+        return self.__bool__()
+
+
+class Expression:
+    """Base of the condition language, combine expressions with &, | and ~ or All, Any, Not and Hold"""
+    def __and__(self, other):
+        return All(self, other)
+
+    def __or__(self, other):
+        return Any(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    def compile(self, clock=time.time):
+        return CompiledCondition(self, clock)
+
+
+class Above(Expression):
+    def __init__(self, device, threshold):
+        self.device = device
+        self.threshold = threshold
+
+
+class Below(Expression):
+    def __init__(self, device, threshold):
+        self.device = device
+        self.threshold = threshold
+
+
+class Within(Expression):
+    def __init__(self, device, center, epsilon):
+        self.device = device
+        self.center = center
+        self.epsilon = epsilon
+
+
+class Is(Expression):
+    def __init__(self, switch, on=True):
+        self.device = switch
+        self.on = on
+
+
+class All(Expression):
+    def __init__(self, *expressions):
+        self.expressions = expressions
+
+
+class Any(Expression):
+    def __init__(self, *expressions):
+        self.expressions = expressions
+
+
+class Not(Expression):
+    def __init__(self, expression):
+        self.expression = expression
+
+
+class Hold(Expression):
+    """True once the inner expression was true without interruption for the given seconds"""
+    def __init__(self, expression, seconds):
+        self.expression = expression
+        self.seconds = seconds
+
+
+ABOVE, BELOW, WITHIN, IS, ALL, ANY, NOT, HOLD = range(8)
+
+
+def take_snapshot(devices):
+    """Reads every device exactly once, the result can be evaluated by any number of conditions"""
+    return {device: device.value for device in devices}
+
+
+def all_fulfilled(conditions):
+    """True if every condition is fulfilled, all of them are evaluated against one snapshot of their inputs.
+
+    Plain booleans from the level table are taken as they are.
+    """
+    devices = []
+    for condition in conditions:
+        for device in getattr(condition, 'devices', ()):
+            if device not in devices:
+                devices.append(device)
+    snapshot = take_snapshot(devices)
+    return all(condition.evaluate(snapshot) if hasattr(condition, 'evaluate') else condition
+               for condition in conditions)
+
+
+class CompiledCondition:
+    """An expression flattened into a postfix program, evaluated against one snapshot of its inputs"""
+    def __init__(self, expression, clock=time.time):
+        self.expression = expression
+        self.clock = clock
+        self.devices = []
+        self.program = []
+        self.hold_times = []
+        self._hold_started = []
+        self.emit(expression)
+
+    def emit(self, expression):
+        if isinstance(expression, (Above, Below, Within, Is)):
+            if expression.device not in self.devices:
+                self.devices.append(expression.device)
+            device = expression.device
+            if isinstance(expression, Above):
+                self.program.append((ABOVE, device, expression.threshold))
+            elif isinstance(expression, Below):
+                self.program.append((BELOW, device, expression.threshold))
+            elif isinstance(expression, Within):
+                self.program.append((WITHIN, device, expression.center, expression.epsilon))
+            else:
+                self.program.append((IS, device, expression.on))
+        elif isinstance(expression, (All, Any)):
+            if not expression.expressions:
+                raise ValueError('{} needs at least one expression'.format(type(expression).__name__))
+            for inner in expression.expressions:
+                self.emit(inner)
+            self.program.append((ALL if isinstance(expression, All) else ANY, len(expression.expressions)))
+        elif isinstance(expression, Not):
+            self.emit(expression.expression)
+            self.program.append((NOT,))
+        elif isinstance(expression, Hold):
+            self.emit(expression.expression)
+            self.program.append((HOLD, len(self.hold_times)))
+            self.hold_times.append(expression.seconds)
+            self._hold_started.append(None)
+        else:
+            raise TypeError('Cannot compile {!r} into a condition'.format(expression))
+
+    def evaluate(self, snapshot):
+        now = self.clock() if self.hold_times else None
+        stack = []
+        for instruction in self.program:
+            opcode = instruction[0]
+            if opcode == ABOVE:
+                stack.append(snapshot[instruction[1]] > instruction[2])
+            elif opcode == BELOW:
+                stack.append(snapshot[instruction[1]] < instruction[2])
+            elif opcode == WITHIN:
+                stack.append(abs(snapshot[instruction[1]] - instruction[2]) < instruction[3])
+            elif opcode == IS:
+                stack.append(bool(snapshot[instruction[1]]) == instruction[2])
+            elif opcode == ALL or opcode == ANY:
+                values = stack[-instruction[1]:]
+                del stack[-instruction[1]:]
+                stack.append(all(values) if opcode == ALL else any(values))
+            elif opcode == NOT:
+                stack.append(not stack.pop())
+            else:
+                slot = instruction[1]
+                if stack.pop():
+                    if self._hold_started[slot] is None:
+                        self._hold_started[slot] = now
+                    stack.append(now - self._hold_started[slot] >= self.hold_times[slot])
+                else:
+                    self._hold_started[slot] = None
+                    stack.append(False)
+        return stack[0]
+
+    def __bool__(self):
+        return self.evaluate(take_snapshot(self.devices))
+
     @property
     def fulfilled(self):
         return self.__bool__()
 
+    def time_until_hold(self):
+        """Seconds until the first running hold window expires, None if none is running"""
+        now = self.clock()
+        # An expired window keeps its start time while its expression holds, but there is nothing left to wait for
+        remaining = [seconds - (now - started) for seconds, started in zip(self.hold_times, self._hold_started)
+                     if started is not None and seconds - (now - started) > 0.0]
+        return min(remaining) if remaining else None
+
+    def reset(self):
+        self._hold_started = [None] * len(self.hold_times)
+
+    def rebind(self, devices, clock=None):
+        """Compiled copy reading from other devices, devices maps each current device to its replacement"""
+        rebound = CompiledCondition.__new__(CompiledCondition)
+        rebound.expression = self.expression
+        rebound.clock = self.clock if clock is None else clock
+        rebound.devices = [devices.get(device, device) for device in self.devices]
+        rebound.program = [(instruction[0], devices.get(instruction[1], instruction[1])) + instruction[2:]
+                           if instruction[0] in (ABOVE, BELOW, WITHIN, IS) else instruction
+                           for instruction in self.program]
+        rebound.hold_times = list(self.hold_times)
+        rebound._hold_started = [None] * len(self.hold_times)
+        return rebound
+
 
 if __name__ == '__main__':
     from hardware import ADC
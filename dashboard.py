@@ -0,0 +1,218 @@
+"""This module streams the game to a live dashboard in the browser, e.g. http://localhost:8080
+
+One thread takes a snapshot of the current state, the hold_true countdowns and all devices at a low fixed rate and
+renders it to a server-sent event once. Viewers only ever get the newest rendered frame, so any number of them adds
+no load on the game, and a viewer which falls behind skips frames or is disconnected instead of blocking anybody.
+"""
+import json
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Condition
+
+device_attributes = {'adc': 'value', 'switch': 'value', 'led': 'state', 'servo': 'angle'}
+
+page = b'''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Game dashboard</title></head>
+<body style="font-family: monospace">
+<h2 id="state">-</h2><pre id="conditions"></pre><pre id="devices"></pre>
+<script>
+var traces = {};
+var source = new EventSource('/events');
+source.onmessage = function (event) {
+  var frame = JSON.parse(event.data);
+  if (frame.history) { traces = frame.history; }
+  document.getElementById('state').textContent = frame.state || '-';
+  document.getElementById('conditions').textContent = frame.conditions.map(function (condition) {
+    if (condition.hold === null) { return condition.type; }
+    var done = Math.round(20 * condition.progress);
+    return condition.type + ' [' + '#'.repeat(done) + '.'.repeat(20 - done) + '] ' +
+      (condition.remaining === null ? 'not fulfilled' : condition.remaining.toFixed(1) + ' s left');
+  }).join('\\n');
+  document.getElementById('devices').textContent = Object.keys(frame.devices).map(function (name) {
+    var value = frame.devices[name];
+    if (traces[name] !== undefined) {
+      traces[name].push(value);
+      traces[name] = traces[name].slice(-60);
+    }
+    var trace = (traces[name] || []).map(function (sample) {
+      return ' .:-=+*#%@'[Math.max(0, Math.min(9, Math.floor(sample * 10)))];
+    }).join('');
+    return (name + '          ').slice(0, 20) + ' ' + JSON.stringify(value) + ' ' + trace;
+  }).join('\\n');
+};
+</script></body></html>
+'''
+
+
+def condition_progress(condition):
+    """Describes how far a condition got without evaluating it, which would run its hold_true timer"""
+    hold = getattr(condition, 'hold_true', None)
+    if hold is None and getattr(condition, 'hold_times', None):
+        hold = max(condition.hold_times)
+    remaining = condition.time_until_hold() if hasattr(condition, 'time_until_hold') else None
+    progress = 0.0
+    if hold and remaining is not None:
+        progress = min(max(1.0 - remaining / hold, 0.0), 1.0)
+    return {'type': type(condition).__name__, 'hold': hold or None,
+            'remaining': None if remaining is None else round(remaining, 2), 'progress': round(progress, 3)}
+
+
+class Dashboard:
+    def __init__(self, game, devices, port=8080, rate=10.0, history=60, send_timeout=1.0):
+        """game is anything with a current_state, devices a DeviceRegistry or dict of devices"""
+        self.game = game
+        self.devices = devices
+        self.port = port
+        self.period = 1.0 / rate
+        self.send_timeout = send_timeout
+        self.traces = {}
+        self.history = history
+        self.frame = None
+        self.latest = None
+        self.sequence = 0
+        self.viewers = 0
+        self.dropped = 0
+        self.condition = Condition()
+        self.server = None
+        self.running = False
+
+    def device_values(self):
+        values = {}
+        items = self.devices.devices.items() if hasattr(self.devices, 'devices') else self.devices.items()
+        for name, device in items:
+            # Devices the game has not created yet are not created just to be shown
+            if getattr(device, 'created', True) is False:
+                continue
+            kind = self.devices.specs[name]['type'] if hasattr(self.devices, 'specs') else None
+            attribute = device_attributes.get(kind, 'value')
+            try:
+                value = getattr(device, attribute)
+            except (AttributeError, IOError):
+                continue
+            values[name] = round(value, 3) if isinstance(value, float) else value
+        return values
+
+    def snapshot(self):
+        state = self.game.current_state
+        conditions = [] if state is None else [condition_progress(condition) for condition in state.conditions]
+        devices = self.device_values()
+        return {'time': round(time.time(), 2), 'state': None if state is None else state.name,
+                'conditions': conditions, 'devices': devices}
+
+    @staticmethod
+    def render(frame):
+        return ('data: %s\n\n' % json.dumps(frame)).encode('utf-8')
+
+    def update(self):
+        snapshot = self.snapshot()
+        frame = self.render(snapshot)
+        with self.condition:
+            # Viewers copy the traces under the same lock
+            for name, value in snapshot['devices'].items():
+                if isinstance(value, float):
+                    self.traces.setdefault(name, deque(maxlen=self.history)).append(value)
+            self.latest = snapshot
+            self.frame = frame
+            self.sequence += 1
+            self.condition.notify_all()
+
+    def next_frame(self, sequence, timeout):
+        """Newest frame after sequence, frames a viewer was too slow for are skipped"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence > sequence or not self.running, timeout=timeout)
+            if self.sequence > sequence + 1 and sequence:
+                self.dropped += self.sequence - sequence - 1
+            return self.sequence, self.frame
+
+    def first_frame(self, timeout=None):
+        """Newest frame with the traces so far, None if the first snapshot was not taken within timeout.
+
+        Viewer threads never take snapshots themselves, only update_loop reads the devices.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.latest is not None or not self.running, timeout=timeout)
+            if self.latest is None:
+                return self.sequence, None
+            frame = dict(self.latest, history={name: list(trace) for name, trace in self.traces.items()})
+            return self.sequence, self.render(frame)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        # Only reachable from the board itself, e.g. through an ssh tunnel
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port), self.handler())
+        self.server.daemon_threads = True
+        for target in (self.server.serve_forever, self.update_loop):
+            thread = Thread(target=target, args=())
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def update_loop(self):
+        while self.running:
+            start = time.monotonic()
+            try:
+                self.update()
+            except Exception as error:
+                # The dashboard must never take the game down
+                print('Dashboard could not take a snapshot: %s' % error)
+            time.sleep(max(0.0, self.period - (time.monotonic() - start)))
+
+    def handler(self):
+        dashboard = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == '/':
+                    self.reply('text/html', page)
+                elif self.path == '/snapshot':
+                    sequence, frame = dashboard.first_frame(timeout=dashboard.period * 10)
+                    if frame is None:
+                        self.send_error(503, 'No snapshot taken yet')
+                    else:
+                        self.reply('application/json', frame[len(b'data: '):].strip())
+                elif self.path == '/events':
+                    self.stream()
+                else:
+                    self.send_error(404)
+
+            def reply(self, content_type, body):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def stream(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                self.connection.settimeout(dashboard.send_timeout)
+                with dashboard.condition:
+                    dashboard.viewers += 1
+                try:
+                    sequence, frame = dashboard.first_frame()
+                    while dashboard.running and frame is not None:
+                        self.wfile.write(frame)
+                        self.wfile.flush()
+                        sequence, frame = dashboard.next_frame(sequence, timeout=dashboard.period * 10)
+                except OSError:
+                    # Gone or too slow to take a frame within send_timeout
+                    pass
+                finally:
+                    with dashboard.condition:
+                        dashboard.viewers -= 1
+
+        return Handler
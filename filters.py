@@ -0,0 +1,137 @@
+"""This module provides streaming filters for the analog channels.
+
+Every filter keeps its state between samples, so an update costs O(1) (moving average, EMA)
+or O(log n) plus a short memmove (rolling median) instead of re-reading a whole window.
+NumPy is used for batched ingestion if it is installed.
+"""
+from bisect import bisect_left, insort
+from collections import deque
+
+from sampler import RingBuffer
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class MovingAverage:
+    def __init__(self, window):
+        self.window = window
+        self.buffer = RingBuffer(window)
+
+    @property
+    def span(self):
+        """Number of samples the filter smooths over"""
+        return self.window
+
+    def update(self, sample):
+        self.buffer.append(sample)
+        return self.value
+
+    def update_many(self, samples):
+        if len(samples) > self.window:
+            samples = samples[-self.window:]
+        for sample in samples:
+            self.buffer.append(float(sample))
+        return self.value
+
+    @property
+    def value(self):
+        return self.buffer.mean() if len(self.buffer) else 0.0
+
+    def __len__(self):
+        return len(self.buffer)
+
+
+class ExponentialMovingAverage:
+    def __init__(self, alpha=0.1):
+        if not 0.0 < alpha <= 1.0:
+            raise ValueError('alpha has to be in (0, 1]')
+        self.alpha = alpha
+        self._value = None
+        self._count = 0
+
+    @property
+    def span(self):
+        # A step is mostly followed after about 1 / alpha samples
+        return max(1, int(round(1.0 / self.alpha)))
+
+    def update(self, sample):
+        if self._value is None:
+            self._value = float(sample)
+        else:
+            self._value += self.alpha * (sample - self._value)
+        self._count += 1
+        return self._value
+
+    def update_many(self, samples):
+        if not len(samples):
+            return self.value
+        if np is None:
+            for sample in samples:
+                self.update(sample)
+            return self._value
+        samples = np.asarray(samples, dtype=float)
+        if self._value is None:
+            self._value = float(samples[0])
+            self._count += 1
+            samples = samples[1:]
+        n = len(samples)
+        if n:
+            # Closed form of n consecutive updates: decayed old value plus weighted new samples
+            decay = 1.0 - self.alpha
+            weights = self.alpha * decay ** np.arange(n - 1, -1, -1)
+            self._value = float(decay ** n * self._value + np.dot(weights, samples))
+            self._count += n
+        return self._value
+
+    @property
+    def value(self):
+        return 0.0 if self._value is None else self._value
+
+    def __len__(self):
+        return self._count
+
+
+class RollingMedian:
+    def __init__(self, window):
+        self.window = window
+        self._samples = deque()
+        self._sorted = []
+
+    @property
+    def span(self):
+        return self.window
+
+    def update(self, sample):
+        sample = float(sample)
+        if len(self._samples) == self.window:
+            oldest = self._samples.popleft()
+            del self._sorted[bisect_left(self._sorted, oldest)]
+        self._samples.append(sample)
+        insort(self._sorted, sample)
+        return self.value
+
+    def update_many(self, samples):
+        if len(samples) >= self.window:
+            # The whole window is replaced, sorting once is cheaper than inserting one by one
+            self._samples = deque(float(sample) for sample in samples[-self.window:])
+            self._sorted = sorted(self._samples)
+            return self.value
+        for sample in samples:
+            self.update(sample)
+        return self.value
+
+    @property
+    def value(self):
+        count = len(self._sorted)
+        if not count:
+            return 0.0
+        middle = count // 2
+        if count % 2:
+            return self._sorted[middle]
+        return (self._sorted[middle - 1] + self._sorted[middle]) / 2.0
+
+    def __len__(self):
+        return len(self._samples)
@@ -1,16 +1,34 @@
 """This is the central game file, where the game logic is contained"""
 
+import atexit
 import time
-from threading import Thread
-from hardware import *
-from conditions import AnalogCondition
-from helpers import cavity_resonant_blinking, kick_out_atom, blink_alternating, blink_together,\
-    blink_randomly, Sound
+from threading import Thread, Event, Lock, current_thread
+from sampler import ADCSampler
+from mixer import SoundEngine
+from mock_server import MockServer
+from async_game import AsyncGame
+from conditions import all_fulfilled
+from dashboard import Dashboard
+from levels import load_levels
+from input_trace import TraceRecorder, TraceReader, ReplayBackend, attach
+from profiler import profiler
+from helpers import Sound, stoppable_actions
 import random
 
 
 class State:
-    sound = Sound('sounds')
+    # Created on first use, listing and loading the sound folder is too slow for import time
+    sound = None
+    sound_folder = 'sounds'
+    poll_interval = 0.1
+    # When set to an ADCSampler, run() blocks until an input changes instead of polling
+    wakeup = None
+    parallel_join_timeout = 1.0
+    # Pause between two passes over the parallel actions, keeps non blocking actions from spinning
+    parallel_interval = 0.01
+    # Number of run_parallel threads currently alive, across all states
+    live_parallel_workers = 0
+    _workers_lock = Lock()
 
     def __init__(self, name, conditions, enter_actions=None, leave_actions=None, random_actions=None,
                  parallel_actions=None, next_states=[], fail_probability=0.0):
@@ -31,118 +49,197 @@ class State:
         self.conditions = [conditions]
         self.next_states = next_states
         self.fail_probability = fail_probability
-        self.stop_parallel_thread = False
+        self.stop_parallel_event = Event()
+        self.parallel_thread = None
+
+    @staticmethod
+    def get_sound():
+        if State.sound is None:
+            State.sound = Sound(State.sound_folder, engine=SoundEngine(State.sound_folder))
+            atexit.register(State.sound.shutdown)
+        return State.sound
 
     def enter(self):
-        State.sound.play_stage_sound(self.next_states[0] - 1)
+        State.get_sound().play_stage_sound(self.next_states[0] - 1)
         if self.next_states[1] != 99:
-            State.sound.start_random_sound_loop()
+            State.get_sound().start_random_sound_loop()
         for action, params in self.enter_actions:
             action(params)
 
     def leave(self):
-        State.sound.stop_sound_loop()
+        State.get_sound().stop_sound_loop()
         for action, params in self.leave_actions:
             action(params)
-        self.stop_parallel_thread = True
+        self.stop_parallel_event.set()
+        if self.parallel_thread is not None and self.parallel_thread is not current_thread():
+            self.parallel_thread.join(timeout=State.parallel_join_timeout)
+            if self.parallel_thread.is_alive():
+                print('Parallel action of {} state did not stop within {:.1f} s'.format(
+                    self.name, State.parallel_join_timeout))
 
     def run_random_action(self):
+        if profiler.enabled:
+            profiler.transition_started = time.perf_counter()
         for action, params in self.random_actions:
             action(params)
         self.leave()
         return self.next_states[1]
 
+    def conditions_fulfilled(self):
+        if not profiler.enabled:
+            return all_fulfilled(self.conditions)
+        started = time.perf_counter()
+        fulfilled = all_fulfilled(self.conditions)
+        finished = time.perf_counter()
+        profiler.record(self.name, 'condition_evaluation', finished - started)
+        if fulfilled:
+            profiler.transition_started = finished
+        return fulfilled
+
     def run(self):
+        if not profiler.enabled:
+            return self.run_state()
+        entered = time.perf_counter()
+        next_state = self.run_state()
+        profiler.record(self.name, 'dwell', time.perf_counter() - entered)
+        return next_state
+
+    def run_state(self):
         self.enter()
-        self.parallel_thread = Thread(target=self.run_parallel, args=())
+        if profiler.enabled and profiler.transition_started is not None:
+            profiler.record(self.name, 'transition_latency', time.perf_counter() - profiler.transition_started)
+            profiler.transition_started = None
+        # Every run gets its own token, so a worker of a previous visit can never miss its stop signal
+        self.stop_parallel_event = Event()
+        self.parallel_thread = Thread(target=self.run_parallel, args=(self.stop_parallel_event,))
         self.parallel_thread.daemon = True
-        self.stop_parallel_thread = False
         self.parallel_thread.start()
+        if State.wakeup is not None:
+            return self.run_event_driven()
         while True:
-            if all(self.conditions):
+            if self.conditions_fulfilled():
                 self.leave()
                 return self.next_states[0]
             if random.random() < self.fail_probability:
                 return self.run_random_action()
-            time.sleep(0.1)
+            time.sleep(State.poll_interval)
 
-    def run_parallel(self):
+    def run_event_driven(self):
+        # fail_probability is given per poll_interval, so the dice are still rolled at that rate
+        next_random_check = time.monotonic() + State.poll_interval
         while True:
-            for action, params in self.parallel_actions:
-                if isinstance(params, tuple):
-                    action(*params)
-                else:
-                    action(params)
-            if self.stop_parallel_thread:
-                break
+            generation = State.wakeup.generation
+            if self.conditions_fulfilled():
+                self.leave()
+                return self.next_states[0]
+            now = time.monotonic()
+            timeout = None
+            if self.fail_probability:
+                if now >= next_random_check:
+                    next_random_check = now + State.poll_interval
+                    if random.random() < self.fail_probability:
+                        return self.run_random_action()
+                timeout = next_random_check - now
+            hold_timeouts = [condition.time_until_hold() for condition in self.conditions
+                             if hasattr(condition, 'time_until_hold')]
+            hold_timeouts = [hold_timeout + 0.001 for hold_timeout in hold_timeouts if hold_timeout is not None]
+            if hold_timeouts:
+                timeout = min(hold_timeouts) if timeout is None else min(timeout, *hold_timeouts)
+            State.wakeup.wait_for_change(timeout=timeout, since=generation)
+
+    def run_parallel(self, stop_event):
+        with State._workers_lock:
+            State.live_parallel_workers += 1
+        try:
+            while not stop_event.is_set():
+                started = time.perf_counter()
+                for action, params in self.parallel_actions:
+                    if stop_event.is_set():
+                        break
+                    if action is time.sleep:
+                        # Sleep on the token instead, so leave() does not have to wait for it
+                        stop_event.wait(params)
+                    elif action in stoppable_actions:
+                        action(*(params if isinstance(params, tuple) else (params,)), stop_event=stop_event)
+                    elif isinstance(params, tuple):
+                        action(*params)
+                    else:
+                        action(params)
+                if profiler.enabled:
+                    profiler.record(self.name, 'parallel_iteration', time.perf_counter() - started)
+                stop_event.wait(State.parallel_interval)
+        finally:
+            with State._workers_lock:
+                State.live_parallel_workers -= 1
 
 
 class Game:
     debug = True
     mock_hardware = False
-    hold_time = 3
-    laser_poti = ADC(pin="AIN3", mock_hardware=mock_hardware)
-    cavity_poti = ADC(pin="AIN1", mock_hardware=mock_hardware)
-    atom_poti = ADC(pin="AIN5", mock_hardware=mock_hardware)
-    photo_diode = ADC(pin="AIN4", mock_hardware=mock_hardware, average_samples=100)
-    laser_switch = Switch(pin="P9_30", mock_hardware=mock_hardware)
-
-    cavity_green_led = LED("P9_15")
-    cavity_blue_led = LED("P9_23")
-    spcm_0_led = LED("P8_15")
-    spcm_1_led = LED("P9_27")
-    laser_led = LED("P9_41")
-
-    atom_servo = Servo("P9_14", min_duty=6.0, max_duty=13.0)
-    atom_eject_servo = Servo("P9_42", min_duty=6.0, max_duty=13.0)
-    cavity_servo = Servo("P8_13", min_duty=7.0, max_duty=15.0)
-
-    states = {0: State('Align Mirror',
-                       AnalogCondition(photo_diode, threshold=0.4, condition='bigger',
-                                       hold_true=hold_time, debug=debug), next_states=[1, 1]),
-
-              1: State('Change Cavity Length',
-                       AnalogCondition(cavity_poti, condition='equal', equal_epsilon=0.03,
-                                       threshold=0.7, hold_true=hold_time, debug=debug),
-                       next_states=[2, 2], parallel_actions=[(cavity_resonant_blinking,
-                                                              (cavity_blue_led, cavity_green_led,
-                                                               cavity_poti))]),
-
-              2: State('Trap Atom',
-                       AnalogCondition(photo_diode, threshold=0.15, hold_true=hold_time,
-                                       condition='smaller', debug=debug), next_states=[3, 3]),
-
-              3: State('Tune Frequency Blocking',
-                       AnalogCondition(laser_poti, condition='equal', equal_epsilon=0.1,
-                                       threshold=0.2, hold_true=hold_time, debug=debug), next_states=[4, 2],
-                       fail_probability=0.02, random_actions=[(kick_out_atom, atom_eject_servo)],
-                       parallel_actions=[(blink_randomly, (spcm_0_led, spcm_1_led))]),
-
-              4: State('Tune Frequency Conjunct Tunneling',
-                       AnalogCondition(laser_poti, condition='equal', equal_epsilon=0.1,
-                                       threshold=0.7, hold_true=hold_time, debug=debug),
-                       parallel_actions=[(blink_alternating, (spcm_0_led, spcm_1_led))], next_states=[5, 5]),
-              5: State('Success', False, next_states=[5, 99],
-                       parallel_actions=[(blink_together, (spcm_0_led, spcm_1_led))]),
-              }
-
-    def __init__(self):
-        self.servo_thread = Thread(target=self.thread_target, args=())
-        self.servo_thread.daemon = True
-        self.servo_thread.start()
+    event_driven = True
+    use_asyncio = False
+    # Records per state timing histograms, dump them with kill -USR1 or read /tmp/hatgame_profile.sock
+    profile = False
+    levels_file = 'levels.json'
+    # Record all inputs into this trace file, or play the inputs back from one instead of reading hardware
+    record_file = None
+    replay_file = None
+    # Serves a live dashboard on http://localhost:<port>
+    dashboard_port = None
+
+    def __init__(self, levels_file=None, run=True):
+        self.levels = load_levels(levels_file or Game.levels_file)
+        self.sampler = ADCSampler(rate=self.levels.sample_rate)
+        mock_hardware, backend = Game.mock_hardware, None
+        if Game.replay_file:
+            mock_hardware, backend = True, ReplayBackend(TraceReader(Game.replay_file))
+        # Devices are only created when a state or the wiring first uses them
+        self.devices = self.levels.registry(mock_hardware=mock_hardware, sampler=self.sampler, backend=backend)
+        self.states = self.levels.build_states(self.devices, debug=Game.debug, state_class=State)
+        self.wiring = None
+        self.current_state = None
+        self.recorder = None
+        if run:
+            self.run()
+
+    def run(self):
+        if Game.profile:
+            profiler.enabled = True
+            profiler.install_signal_handler()
+            profiler.serve()
+        if Game.record_file:
+            self.recorder = TraceRecorder(Game.record_file)
+            self.recorder.start_flushing()
+            # Writes the last buffered records and the channel names on Ctrl+C and normal exits
+            atexit.register(self.recorder.close)
+            attach(self.recorder)
+        if Game.mock_hardware and not Game.replay_file:
+            # Lets mock_hardware.py and scripted clients see and drive all devices of the level file
+            mock_server = MockServer(self.levels)
+            mock_server.start()
+            atexit.register(mock_server.stop)
+        self.wiring = self.levels.build_wiring(self.devices, wakeup=self.sampler)
+        self.sampler.start()
+        if Game.use_asyncio:
+            engine = AsyncGame(self.states, wiring=self.wiring.update, sound=State.get_sound())
+            self.start_dashboard(engine)
+            engine.run()
+            return
+        self.start_dashboard(self)
+        if Game.event_driven:
+            State.wakeup = self.sampler
+        self.wiring.start()
         self.event_loop()
 
-    def thread_target(self):
-        while True:
-            # Do all 'wiring' here
-            Game.cavity_servo.angle = Game.cavity_poti.value
-            Game.atom_servo.angle = Game.atom_poti.value
-            Game.laser_led.state = Game.laser_switch.value
+    def start_dashboard(self, game):
+        if Game.dashboard_port:
+            Dashboard(game, self.devices, port=Game.dashboard_port).start()
 
     def event_loop(self):
         next_state = 0
         while True:
-            next_state = Game.states[next_state].run()
+            self.current_state = self.states[next_state]
+            next_state = self.current_state.run()
 
 
 if __name__ == '__main__':
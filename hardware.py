@@ -1,25 +1,71 @@
 """This modules provides the hardware access"""
-import Adafruit_BBIO.ADC as adc
-import Adafruit_BBIO.GPIO as gpio
-import Adafruit_BBIO.PWM as PWM
+import mmap
+import os
+import struct
+import time
+from threading import Lock, local
+try:
+    import Adafruit_BBIO.ADC as adc
+    import Adafruit_BBIO.GPIO as gpio
+    import Adafruit_BBIO.PWM as PWM
+except ImportError:
+    # Only available on the BeagleBone, everything with mock_hardware=True works without it
+    adc = gpio = PWM = None
+
+
+from mock_backend import shared_backend
+from telemetry import telemetry
+from profiler import profiler
+
+# Set to an input_trace.TraceRecorder to record every ADC and switch read
+recorder = None
+
+
+def require_hardware(pin):
+    if gpio is None:
+        raise ImportError('Adafruit_BBIO is needed to access {}, use mock_hardware=True without it'.format(pin))
 
 
 class ADC:
     adc_subsystem_started = False
 
-    def __init__(self, pin, average_samples=None, mock_hardware=False):
+    def __init__(self, pin, average_samples=None, mock_hardware=False, sampler=None, sample_filter=None,
+                 backend=None):
         self.pin = pin
         self._value = 0.0
         self.average_samples = average_samples
+        self.sample_filter = sample_filter
         self.mock_hardware = mock_hardware
         if self.mock_hardware:
-            self.path = "hardware_files/%s" % self.pin
+            self.backend = backend if backend is not None else shared_backend()
         if not ADC.adc_subsystem_started and not self.mock_hardware:
+            require_hardware(self.pin)
             adc.setup()
             ADC.adc_subsystem_started = True
+        self.sampler = sampler
+        self.buffer = None
+        if self.sampler is not None:
+            self.buffer = self.sampler.register(self, self.sample, buffer_size=self.average_samples)
 
     @property
     def value(self):
+        if self.sample_filter is not None:
+            if self.buffer is None or not len(self.buffer):
+                # Without a sampler a read has to take as many samples as the filter smooths over, otherwise
+                # a moving average over 100 samples would take 100 polls to follow a change
+                try:
+                    self.sample_filter.update_many([self.adc_read() for _ in range(self.samples_per_read)])
+                except IOError:
+                    raise IOError('Cannot read ADC {}'.format(self.pin))
+            self._value = self.sample_filter.value
+            return self._value
+        if self.buffer is not None and len(self.buffer):
+            # The sampler thread keeps the buffer filled, so this is just a lookup
+            if self.average_samples:
+                self._value = self.buffer.mean(self.average_samples)
+            else:
+                self._value = self.buffer.latest
+            return self._value
         try:
             if self.average_samples:
                 self._value = sum([self.adc_read() for _ in range(self.average_samples)]) / float(
@@ -31,10 +77,38 @@ class ADC:
             raise IOError('Cannot read ADC {}'.format(self.pin))
         return self._value
 
+    @property
+    def samples_per_read(self):
+        if self.average_samples:
+            return self.average_samples
+        return getattr(self.sample_filter, 'span', 1)
+
+    def sample(self):
+        value = self.adc_read()
+        if self.sample_filter is not None:
+            self.sample_filter.update(value)
+        return value
+
+    def ingest(self, samples):
+        """Feeds a block of samples at once, e.g. from a sampler reading in bursts"""
+        if self.sample_filter is not None:
+            self.sample_filter.update_many(samples)
+        if self.buffer is not None:
+            for sample in samples:
+                self.buffer.append(sample)
+
     def adc_read(self):
+        telemetry.count(self.pin, 'reads')
+        if profiler.enabled:
+            started = time.perf_counter()
+            value = self.read_value()
+            profiler.record(self.pin, 'adc_read', time.perf_counter() - started)
+            return value
+        return self.read_value()
+
+    def read_value(self):
         if self.mock_hardware:
-            with open(self.path, 'r') as fh:
-                value = fh.read()
+            value = self.backend.read(self.pin)
         else:
             value = adc.read(self.pin)
         try:
@@ -42,45 +116,171 @@ class ADC:
         except ValueError:
             # print('Could not convert %s to float' % value)
             ret_val = 0.0
+        if recorder is not None:
+            recorder.record(self.pin, ret_val)
         return ret_val
 
 
 class Switch:
-    def __init__(self, pin, mock_hardware=False):
+    def __init__(self, pin, mock_hardware=False, sampler=None, backend=None):
         self.pin = pin
         self.mock_hardware = mock_hardware
         self._value = False
         if self.mock_hardware:
-            self.path = "hardware_files/%s" % self.pin
-
-        if not self.mock_hardware:
+            self.backend = backend if backend is not None else shared_backend()
+        else:
+            require_hardware(self.pin)
             gpio.setup(self.pin, gpio.IN)
+        self.sampler = sampler
+        self.buffer = None
+        if self.sampler is not None:
+            self.buffer = self.sampler.register(self, self.read_pin, buffer_size=1)
 
     @property
     def value(self):
+        if self.buffer is not None and len(self.buffer):
+            self._value = self.buffer.latest
+            return bool(self._value)
         try:
-            if not self.mock_hardware:
-                self._value = gpio.input(self.pin)
-            else:
-                with open(self.path, 'r') as fh:
-                    value = fh.read()
-                try:
-                    self._value = True if value == '1' else False
-                except ValueError:
-                    print("Error reading %s" % self.path)
-                    self._value = False
+            self._value = self.read_pin()
         except IOError:
             self._value = False
             raise IOError('Cannot read GPIO {}'.format(self.pin))
         return bool(self._value)
 
+    def read_pin(self):
+        if not self.mock_hardware:
+            value = bool(gpio.input(self.pin))
+        else:
+            value = self.backend.read(self.pin) >= 0.5
+        if recorder is not None:
+            recorder.record(self.pin, 1.0 if value else 0.0)
+        return value
+
+
+# GPIO numbers (bank * 32 + bit) of the header pins, needed to write the bank registers directly
+gpio_numbers = {'P8_11': 45, 'P8_12': 44, 'P8_14': 26, 'P8_15': 47, 'P8_16': 46, 'P8_17': 27, 'P8_18': 65,
+                'P9_12': 60, 'P9_15': 48, 'P9_23': 49, 'P9_27': 115, 'P9_30': 112, 'P9_41': 20}
+
+
+class GPIOBankWriter:
+    """Writes all pins of one AM335x GPIO bank with a single SETDATAOUT and CLEARDATAOUT register write"""
+    bank_addresses = (0x44E07000, 0x4804C000, 0x481AC000, 0x481AE000)
+    bank_size = 0x1000
+    clear_data_out = 0x190
+    set_data_out = 0x194
+
+    def __init__(self):
+        self.banks = []
+        fd = os.open('/dev/mem', os.O_RDWR | os.O_SYNC)
+        try:
+            for address in GPIOBankWriter.bank_addresses:
+                self.banks.append(mmap.mmap(fd, GPIOBankWriter.bank_size, offset=address))
+        finally:
+            os.close(fd)
+
+    def write(self, pin_states):
+        """Writes the pins it knows, returns the ones it doesn't"""
+        masks = {}
+        unknown = []
+        for pin, state in pin_states:
+            number = gpio_numbers.get(pin)
+            if number is None:
+                unknown.append((pin, state))
+                continue
+            bank, bit = divmod(number, 32)
+            set_mask, clear_mask = masks.get(bank, (0, 0))
+            if state:
+                set_mask |= 1 << bit
+            else:
+                clear_mask |= 1 << bit
+            masks[bank] = (set_mask, clear_mask)
+        for bank, (set_mask, clear_mask) in masks.items():
+            if set_mask:
+                struct.pack_into('<I', self.banks[bank], GPIOBankWriter.set_data_out, set_mask)
+            if clear_mask:
+                struct.pack_into('<I', self.banks[bank], GPIOBankWriter.clear_data_out, clear_mask)
+        return unknown
+
+
+class OutputBatch:
+    """Collects LED states and servo duty cycles and writes them in one go.
+
+    Inside a with block (per thread) writes are only recorded, later writes to the same pin replace earlier
+    ones, and everything the thread recorded is flushed when its outermost block is left. Outside of a block
+    writes go out immediately.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self._local = local()
+        self.bank_writer = None
+        self._bank_writer_checked = False
+        self.flushes = 0
+
+    @property
+    def active(self):
+        return getattr(self._local, 'depth', 0) > 0
+
+    def __enter__(self):
+        depth = getattr(self._local, 'depth', 0)
+        if not depth:
+            self._local.pending = {}
+        self._local.depth = depth + 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._local.depth -= 1
+        if not self._local.depth:
+            self.flush()
+
+    def set(self, device, value):
+        # Only called inside a block, so the batch of this thread exists
+        self._local.pending[device.pin] = (device, value)
+
+    def get_bank_writer(self):
+        with self.lock:
+            if not self._bank_writer_checked:
+                self._bank_writer_checked = True
+                try:
+                    self.bank_writer = GPIOBankWriter()
+                except (OSError, ValueError):
+                    # Needs root and a BeagleBone, pins are written one by one through Adafruit_BBIO otherwise
+                    self.bank_writer = None
+        return self.bank_writer
+
+    def flush(self):
+        """Writes the batch of the calling thread, batches other threads are still building stay untouched"""
+        pending, self._local.pending = getattr(self._local, 'pending', {}), {}
+        if not pending:
+            return
+        with self.lock:
+            self.flushes += 1
+        gpio_states = []
+        for pin, (device, value) in pending.items():
+            if isinstance(device, LED) and not device.mock_hardware:
+                gpio_states.append((pin, value))
+            else:
+                device.write(value)
+        if gpio_states:
+            bank_writer = self.get_bank_writer() if len(gpio_states) > 1 else None
+            if bank_writer is not None:
+                gpio_states = bank_writer.write(gpio_states)
+            for pin, value in gpio_states:
+                gpio.output(pin, gpio.HIGH if value else gpio.LOW)
+
+
+outputs = OutputBatch()
+
 
 class LED:
-    def __init__(self, pin, mock_hardware=False):
+    def __init__(self, pin, mock_hardware=False, backend=None):
         self.pin = pin
         self.mock_hardware = mock_hardware
         if not self.mock_hardware:
+            require_hardware(self.pin)
             gpio.setup(self.pin, gpio.OUT)
+        else:
+            self.backend = backend if backend is not None else shared_backend()
         self._state = False
 
     def turn_on(self):
@@ -96,22 +296,33 @@ class LED:
     @state.setter
     def state(self, new_state):
         if new_state != self.state:
-            print("Turning led  %s to %s" % (self.pin, new_state))
+            telemetry.count(self.pin, 'writes')
+            telemetry.event('led', pin=self.pin, state=bool(new_state))
             self._state = new_state
-            if not self.mock_hardware:
-                if new_state:
-                    gpio.output(self.pin, gpio.HIGH)
-                else:
-                    gpio.output(self.pin, gpio.LOW)
+            if outputs.active:
+                outputs.set(self, bool(new_state))
+            else:
+                self.write(new_state)
+
+    def write(self, state):
+        if self.mock_hardware:
+            self.backend.write(self.pin, 1.0 if state else 0.0)
+        elif state:
+            gpio.output(self.pin, gpio.HIGH)
+        else:
+            gpio.output(self.pin, gpio.LOW)
 
 
 class Servo:
-    def __init__(self, pin, min_duty=4.0, max_duty=15.0, mock_hardware=False):
+    def __init__(self, pin, min_duty=4.0, max_duty=15.0, mock_hardware=False, backend=None):
         self.pin = pin
         self.mock_hardware = mock_hardware
         if not self.mock_hardware:
+            require_hardware(self.pin)
             print("Initializing hardware")
             PWM.start(self.pin, min_duty)
+        else:
+            self.backend = backend if backend is not None else shared_backend()
         self.set_frequency(68.0)
         self.max_duty = max_duty
         self.min_duty = min_duty
@@ -133,8 +344,7 @@ class Servo:
     def angle(self, value):
         if abs(self.angle - value) > self.movement_threshold:
             self._angle = value
-            if self.mock_hardware:
-                print("%s Setting angle to %.2f" % (self.pin, value))
+            telemetry.event('servo_angle', pin=self.pin, angle=value)
             value = value * 100.0
             duty_range = self.max_duty - self.min_duty
             step = duty_range / 100.0
@@ -142,8 +352,17 @@ class Servo:
             self.set_duty_cycle(duty_cycle)
 
     def set_duty_cycle(self, duty_cycle):
-        if not self.mock_hardware:
-            print(duty_cycle)
+        telemetry.count(self.pin, 'writes')
+        telemetry.event('servo_duty', pin=self.pin, duty_cycle=duty_cycle)
+        if outputs.active:
+            outputs.set(self, duty_cycle)
+        else:
+            self.write(duty_cycle)
+
+    def write(self, duty_cycle):
+        if self.mock_hardware:
+            self.backend.write(self.pin, duty_cycle)
+        else:
             PWM.set_duty_cycle(self.pin, duty_cycle)
 
 
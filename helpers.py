@@ -1,83 +1,285 @@
 """This module provides helper functions for several different tasks"""
-import os
+import asyncio
 import random
 import subprocess
 import time
-from queue import Queue
-from threading import Thread
+from collections import deque
+from queue import Empty
+from threading import Thread, Condition
+
+from hardware import outputs
+from mixer import STAGE_PRIORITY, INSULT_PRIORITY, SoundLibrary
+
+
+class ResonanceBand:
+    """Equally spaced resonances offset + n * spacing for n in range(count), each epsilon wide"""
+    def __init__(self, spacing, offset=0.0, count=10, epsilon=0.02):
+        self.spacing = spacing
+        self.offset = offset
+        self.count = count
+        self.epsilon = epsilon
+
+    def lit(self, reading):
+        # Only the nearest resonance can be the closest one, so no need to scan all of them
+        index = int(round((reading - self.offset) / self.spacing))
+        index = min(max(index, 0), self.count - 1)
+        return abs(reading - (self.offset + index * self.spacing)) < self.epsilon
+
+    def lit_many(self, readings):
+        return [self.lit(reading) for reading in readings]
+
+    def lit_any(self, readings):
+        return any(self.lit(reading) for reading in readings)
+
+
+cavity_lightfield_1 = ResonanceBand(spacing=0.18)
+cavity_lightfield_2 = ResonanceBand(spacing=0.16, offset=0.08)
 
 
 def cavity_resonant_blinking(led_0, led_1, adc):
-    epsilon = 0.02
-    steps_lightfield_1 = [x * 0.18 for x in range(10)]
-    steps_lightfield_2 = [x * 0.16 + 0.08 for x in range(10)]
     adc_read = adc.value
-    led_0.state = True if any(map(lambda x: abs(adc_read - x) < epsilon, steps_lightfield_1)) else False
-    led_1.state = True if any(map(lambda x: abs(adc_read - x) < epsilon, steps_lightfield_2)) else False
+    with outputs:
+        led_0.state = cavity_lightfield_1.lit(adc_read)
+        led_1.state = cavity_lightfield_2.lit(adc_read)
+
+
+kick_script = [(1.0, 0.5), (0.0, 0.5)]
 
 
 def kick_out_atom(servo):
+    if hasattr(servo, 'play'):
+        # Planned servos step through the kick on their own
+        servo.play(kick_script)
+        return
     servo.angle = 1.0
     time.sleep(0.5)
     servo.angle = 0.0
     time.sleep(0.5)
 
 
-def blink_randomly(led_0, led_1):
-    led_0.state = bool(random.randint(0, 1))
-    led_1.state = bool(random.randint(0, 1))
-    time.sleep(0.3)
+def pause(seconds, stop_event=None):
+    """Sleeps, or waits on stop_event if given, returns True if the caller should stop"""
+    if stop_event is None:
+        time.sleep(seconds)
+        return False
+    return stop_event.wait(seconds)
+
+
+def blink_randomly(led_0, led_1, stop_event=None):
+    with outputs:
+        led_0.state = bool(random.randint(0, 1))
+        led_1.state = bool(random.randint(0, 1))
+    pause(0.3, stop_event)
+
+
+def blink_alternating(led_0, led_1, stop_event=None):
+    with outputs:
+        led_0.state = True
+        led_1.state = False
+    if pause(0.3, stop_event):
+        return
+    with outputs:
+        led_0.state = False
+        led_1.state = True
+    pause(0.3, stop_event)
+
+
+def blink_together(led_0, led_1, stop_event=None):
+    with outputs:
+        led_0.state = True
+        led_1.state = True
+    if pause(0.3, stop_event):
+        return
+    with outputs:
+        led_0.state = False
+        led_1.state = False
+    pause(0.3, stop_event)
+
+
+# Parallel actions which take the stop token of their state, so leaving the state does not wait for them
+stoppable_actions = (blink_randomly, blink_alternating, blink_together)
+
+
+async def async_kick_out_atom(servo):
+    if hasattr(servo, 'play'):
+        servo.play(kick_script)
+        return
+    servo.angle = 1.0
+    await asyncio.sleep(0.5)
+    servo.angle = 0.0
+    await asyncio.sleep(0.5)
+
+
+async def async_blink_randomly(led_0, led_1):
+    with outputs:
+        led_0.state = bool(random.randint(0, 1))
+        led_1.state = bool(random.randint(0, 1))
+    await asyncio.sleep(0.3)
+
+
+async def async_blink_alternating(led_0, led_1):
+    with outputs:
+        led_0.state = True
+        led_1.state = False
+    await asyncio.sleep(0.3)
+    with outputs:
+        led_0.state = False
+        led_1.state = True
+    await asyncio.sleep(0.3)
 
 
-def blink_alternating(led_0, led_1):
-    led_0.state = True
-    led_1.state = False
-    time.sleep(0.3)
-    led_0.state = False
-    led_1.state = True
-    time.sleep(0.3)
+async def async_blink_together(led_0, led_1):
+    with outputs:
+        led_0.state = True
+        led_1.state = True
+    await asyncio.sleep(0.3)
+    with outputs:
+        led_0.state = False
+        led_1.state = False
+    await asyncio.sleep(0.3)
 
 
-def blink_together(led_0, led_1):
-    led_0.state = True
-    led_1.state = True
-    time.sleep(0.3)
-    led_0.state = False
-    led_1.state = False
-    time.sleep(0.3)
+class SoundQueue:
+    """Bounded play queue which hands out the highest priority sound first.
+
+    A sound which is already queued is not queued twice, sounds with a deadline are dropped
+    when they are still waiting once it passed. Once closed, get raises Empty right away.
+    """
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self._items = []
+        self._sequence = 0
+        self._condition = Condition()
+        self.closed = False
+        self.dropped_full = 0
+        self.dropped_stale = 0
+        self.coalesced = 0
+        self.latencies = deque(maxlen=100)
+
+    def put(self, sound, priority=INSULT_PRIORITY, deadline=None):
+        now = time.monotonic()
+        with self._condition:
+            if self.closed:
+                return False
+            for item in self._items:
+                if item[2] == sound:
+                    item[0] = max(item[0], priority)
+                    item[4] = None if deadline is None or item[4] is None else max(item[4], now + deadline)
+                    self.coalesced += 1
+                    return True
+            if len(self._items) >= self.maxsize:
+                lowest = min(self._items, key=lambda item: (item[0], -item[1]))
+                if lowest[0] >= priority:
+                    self.dropped_full += 1
+                    return False
+                self._items.remove(lowest)
+                self.dropped_full += 1
+            self._sequence += 1
+            self._items.append([priority, self._sequence, sound, now, None if deadline is None else now + deadline])
+            self._condition.notify()
+            return True
+
+    def get(self, block=True, timeout=None):
+        with self._condition:
+            while True:
+                if self.closed:
+                    raise Empty('Sound queue is closed')
+                now = time.monotonic()
+                stale = [item for item in self._items if item[4] is not None and item[4] < now]
+                for item in stale:
+                    self._items.remove(item)
+                self.dropped_stale += len(stale)
+                if self._items:
+                    break
+                if not block or not self._condition.wait(timeout):
+                    raise Empty('Sound queue is empty')
+            # Highest priority first, first come first served within a priority
+            item = max(self._items, key=lambda item: (item[0], -item[1]))
+            self._items.remove(item)
+            self.latencies.append(now - item[3])
+            return item[2]
+
+    def close(self):
+        """Wakes up every waiting get, e.g. to stop the sound server"""
+        with self._condition:
+            self.closed = True
+            self._items = []
+            self._condition.notify_all()
+
+    def clear(self, max_priority=None):
+        with self._condition:
+            if max_priority is None:
+                self._items = []
+            else:
+                self._items = [item for item in self._items if item[0] > max_priority]
+
+    def qsize(self):
+        with self._condition:
+            return len(self._items)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    @property
+    def metrics(self):
+        latencies = list(self.latencies)
+        return {'depth': self.qsize(),
+                'dropped_full': self.dropped_full,
+                'dropped_stale': self.dropped_stale,
+                'coalesced': self.coalesced,
+                'latency_mean': sum(latencies) / len(latencies) if latencies else 0.0,
+                'latency_max': max(latencies) if latencies else 0.0}
 
 
 class Sound:
-    def __init__(self, soundfolder, effects=None, insults=None, stagesounds=None):
+    random_sound_deadline = 5.0
+
+    def __init__(self, soundfolder, effects=None, insults=None, stagesounds=None, engine=None):
         self.soundfolder = soundfolder
-        sounds = [sound for sound in os.listdir(self.soundfolder) if sound.endswith('.wav')]
-        if effects is None:
-            self.effects = [sound for sound in sounds if sound.startswith('E')]
-        else:
-            self.effects = effects
-        if insults is None:
-            self.insults = [sound for sound in sounds if sound.startswith('I')]
-        else:
-            self.insults = insults
+        self.engine = engine
+        # The engine already indexed the folder, without one only the index is needed
+        library = engine.library if engine is not None else SoundLibrary(soundfolder)
+        self.effects = library.effects if effects is None else effects
+        self.insults = library.insults if insults is None else insults
         if stagesounds is None:
-            self.stagesounds = [sound for sound in sounds if sound.startswith('S')]
-        else:
-            self.stagesounds = stagesounds
-        self.stagesounds.sort(key=lambda x: x[1])
+            stagesounds = library.stagesounds
+        # A list of names is taken as stage 0, 1, ...
+        self.stagesounds = stagesounds if isinstance(stagesounds, dict) else dict(enumerate(stagesounds))
+        self.random_pool = tuple(self.insults + self.effects)
         self.break_sound_loop = False
-        self.sound_queue = Queue()
+        self.running = True
+        self.sound_queue = SoundQueue()
         self.play_thread = Thread(target=self.sound_server, args=())
         self.play_thread.daemon = True
         self.play_thread.start()
 
     def play_sound(self, soundfile):
+        if self.engine is not None:
+            voice = self.engine.play(soundfile, priority=INSULT_PRIORITY)
+            if voice is not None:
+                voice.wait()
+            return
         soundfile = "%s/%s" % (self.soundfolder, soundfile)
         return_code = subprocess.call(['aplay', '--device=default:CARD=Device', soundfile], stdout=subprocess.DEVNULL,
                                       stderr=subprocess.DEVNULL)
 
     def sound_server(self):
-        while True:
-            self.play_sound(self.sound_queue.get())
+        while self.running:
+            try:
+                soundfile = self.sound_queue.get()
+            except Empty:
+                # Only raised once the queue was closed by shutdown
+                break
+            self.play_sound(soundfile)
+
+    def shutdown(self):
+        self.running = False
+        self.break_sound_loop = True
+        self.sound_queue.close()
+        if self.engine is not None:
+            # Finishes the voice the sound server may be waiting for
+            self.engine.shutdown()
+        self.play_thread.join(timeout=1.0)
 
     def start_random_sound_loop(self):
         self.break_sound_loop = False
@@ -89,29 +291,83 @@ class Sound:
         time.sleep(10)
         break_loop = False
         while not break_loop:
-            random_sound = random.choice(self.insults + self.effects)
-            self.sound_queue.put(random_sound)
+            self.queue_random_sound()
             for i in range(100):
                 time.sleep(0.3)
                 if self.break_sound_loop:
                     break_loop = True
                     break
 
+    def queue_random_sound(self):
+        # A random sound which could not be played within the deadline is not worth playing anymore
+        random_sound = random.choice(self.random_pool)
+        self.sound_queue.put(random_sound, priority=INSULT_PRIORITY, deadline=Sound.random_sound_deadline)
+
     def clear_sound_loop(self):
-        while not self.sound_queue.empty():
-            _ = self.sound_queue.get(block=False)
+        self.sound_queue.clear(max_priority=INSULT_PRIORITY)
 
     def stop_sound_loop(self):
         self.break_sound_loop = True
         self.clear_sound_loop()
+        if self.engine is not None:
+            self.engine.stop(max_priority=INSULT_PRIORITY)
 
     def play_stage_sound(self, stagenumber):
         try:
-            self.sound_queue.put(self.stagesounds[stagenumber])
-        except IndexError:
+            if self.engine is not None:
+                # Stage sounds don't queue behind insults, they cut them off
+                self.engine.play(self.stagesounds[stagenumber], priority=STAGE_PRIORITY)
+            else:
+                self.sound_queue.put(self.stagesounds[stagenumber], priority=STAGE_PRIORITY)
+        except KeyError:
             print("Tried to put %d stagesound into queue but doesn't exist" % stagenumber)
 
 
+class SoundChannel:
+    """Sound of one game session on a SoundEngine shared by several sessions.
+
+    Offers the part of the Sound interface the asyncio engine uses. Stage sounds only cut off the insults
+    of their own channel.
+    """
+    def __init__(self, engine, max_voices=1):
+        self.engine = engine
+        self.max_voices = max_voices
+        self.stagesounds = engine.library.stagesounds
+        self.random_pool = engine.library.random_pool
+        self.voices = []
+
+    def play(self, soundfile, priority):
+        self.voices = [voice for voice in self.voices if not voice.finished and not voice.cancelled]
+        if priority == INSULT_PRIORITY and len(self.voices) >= self.max_voices:
+            # Random sounds are skipped rather than queued, there will be another one soon
+            return None
+        for voice in self.voices:
+            if voice.priority < priority:
+                voice.cancel()
+        voice = self.engine.play(soundfile, priority=priority, preempt=False)
+        if voice is not None:
+            self.voices.append(voice)
+        return voice
+
+    def queue_random_sound(self):
+        if self.random_pool:
+            self.play(random.choice(self.random_pool), INSULT_PRIORITY)
+
+    def clear_sound_loop(self):
+        for voice in self.voices:
+            if voice.priority <= INSULT_PRIORITY:
+                voice.cancel()
+
+    def stop_sound_loop(self):
+        self.clear_sound_loop()
+
+    def play_stage_sound(self, stagenumber):
+        try:
+            self.play(self.stagesounds[stagenumber], STAGE_PRIORITY)
+        except KeyError:
+            print("Tried to play %d stagesound but doesn't exist" % stagenumber)
+
+
 if __name__ == '__main__':
     sound = Sound('sounds')
     sound.start_random_sound_loop()
@@ -0,0 +1,232 @@
+"""This module records the hardware inputs into a compact binary trace and replays them.
+
+A trace file starts with a header naming up to max_channels channels, followed by fixed 16 byte records
+of (time since start as float64, channel index as uint16, value as float32). Records are only appended,
+so a trace can be memory-mapped, searched by time with a binary search and read with NumPy as a
+structured array.
+
+A record is only written when the value of its channel changed, the replay holds every value until the next
+record. Noisy ADCs still change on nearly every sample, five of them at 500 Hz are about 144 MB per hour, so
+the recorder stops at max_bytes and counts the records it dropped.
+"""
+import mmap
+import struct
+import time
+from threading import Lock, Thread, Event
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b'HGTR'
+VERSION = 1
+HEADER = struct.Struct('<4sHHd')
+NAME = struct.Struct('<16s')
+RECORD = struct.Struct('<dHxxf')
+if np is not None:
+    record_dtype = np.dtype([('time', '<f8'), ('channel', '<u2'), ('padding', 'V2'), ('value', '<f4')])
+
+
+def header_size(max_channels):
+    return HEADER.size + max_channels * NAME.size
+
+
+class TraceRecorder:
+    def __init__(self, path, max_channels=32, buffer_records=4096, clock=time.monotonic, flush_interval=1.0,
+                 max_bytes=256 * 2 ** 20):
+        """max_bytes caps the size of the trace file, None records without limit"""
+        self.path = path
+        self.flush_interval = flush_interval
+        self._stop = Event()
+        self.thread = None
+        self.max_channels = max_channels
+        self.clock = clock
+        self.start = clock()
+        self.channels = {}
+        self.last_values = []
+        self.lock = Lock()
+        self.buffer = bytearray(buffer_records * RECORD.size)
+        self.buffered = 0
+        self.records = 0
+        self.dropped = 0
+        self.max_records = None
+        if max_bytes is not None:
+            self.max_records = max(0, (max_bytes - header_size(max_channels)) // RECORD.size)
+        self.fh = open(path, 'wb')
+        self.fh.write(HEADER.pack(MAGIC, VERSION, max_channels, time.time()))
+        self.fh.write(b'\0' * (max_channels * NAME.size))
+
+    def channel(self, pin):
+        index = self.channels.get(pin)
+        if index is None:
+            if len(self.channels) >= self.max_channels:
+                raise IndexError('Trace %s is limited to %d channels' % (self.path, self.max_channels))
+            index = self.channels[pin] = len(self.channels)
+            self.last_values.append(None)
+            # The header is rewritten in place, records keep being appended after it
+            position = self.fh.tell()
+            self.fh.seek(HEADER.size + index * NAME.size)
+            self.fh.write(NAME.pack(pin.encode('ascii')))
+            self.fh.seek(position)
+        return index
+
+    def record(self, pin, value):
+        with self.lock:
+            # The sampler thread keeps reading inputs after the trace was closed at exit
+            if self.fh.closed:
+                return
+            index = self.channels.get(pin)
+            if index is None:
+                index = self.channel(pin)
+            if self.last_values[index] == value:
+                return
+            if self.max_records is not None and self.records + self.buffered >= self.max_records:
+                self.dropped += 1
+                return
+            self.last_values[index] = value
+            RECORD.pack_into(self.buffer, self.buffered * RECORD.size, self.clock() - self.start, index, value)
+            self.buffered += 1
+            if self.buffered * RECORD.size == len(self.buffer):
+                self._flush()
+
+    def _flush(self):
+        self.fh.write(memoryview(self.buffer)[:self.buffered * RECORD.size])
+        self.records += self.buffered
+        self.buffered = 0
+
+    def flush(self):
+        with self.lock:
+            if self.fh.closed:
+                return
+            self._flush()
+            self.fh.flush()
+
+    def start_flushing(self):
+        """Flushes to disk every flush_interval, so a killed game loses at most that much of the trace"""
+        if self.thread is not None:
+            return
+        self.thread = Thread(target=self.flush_loop, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    def flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        with self.lock:
+            if self.fh.closed:
+                return
+            self._flush()
+            self.fh.close()
+        if self.dropped:
+            print('Trace %s reached its size limit, %d records were dropped' % (self.path, self.dropped))
+
+
+class TraceReader:
+    def __init__(self, path):
+        self.path = path
+        self.fh = open(path, 'rb')
+        self.memory = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, max_channels, self.started = HEADER.unpack_from(self.memory, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is no trace file of version %d' % (path, VERSION))
+        self.offset = header_size(max_channels)
+        self.channels = []
+        for index in range(max_channels):
+            name = NAME.unpack_from(self.memory, HEADER.size + index * NAME.size)[0].rstrip(b'\0')
+            if not name:
+                break
+            self.channels.append(name.decode('ascii'))
+        # A crash may leave a partial record at the end, it is ignored
+        self.count = (len(self.memory) - self.offset) // RECORD.size
+
+    def close(self):
+        self.memory.close()
+        self.fh.close()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError('Record %d is not in %s' % (index, self.path))
+        timestamp, channel, value = RECORD.unpack_from(self.memory, self.offset + index * RECORD.size)
+        return timestamp, self.channels[channel], value
+
+    def time_at(self, index):
+        return struct.unpack_from('<d', self.memory, self.offset + index * RECORD.size)[0]
+
+    @property
+    def duration(self):
+        return self.time_at(self.count - 1) if self.count else 0.0
+
+    def seek(self, timestamp):
+        """Index of the first record at or after timestamp"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.time_at(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def as_numpy(self):
+        if np is None:
+            raise ImportError('NumPy is needed to read traces as arrays')
+        return np.frombuffer(self.memory, dtype=record_dtype, count=self.count, offset=self.offset)
+
+
+class ReplayBackend:
+    """Backend for mocked devices which plays a trace back in real time, or speed times faster"""
+    def __init__(self, reader, speed=1.0, clock=time.monotonic, loop=False):
+        self.reader = reader
+        self.speed = speed
+        self.clock = clock
+        self.loop = loop
+        self.lock = Lock()
+        self.rewind()
+
+    def rewind(self):
+        self.start = self.clock()
+        self.cursor = 0
+        self.values = {}
+
+    def advance(self):
+        now = (self.clock() - self.start) * self.speed
+        if self.loop and self.reader.count and now > self.reader.duration:
+            self.rewind()
+            now = 0.0
+        reader = self.reader
+        while self.cursor < reader.count and reader.time_at(self.cursor) <= now:
+            _, pin, value = reader[self.cursor]
+            self.values[pin] = value
+            self.cursor += 1
+
+    def read(self, pin):
+        with self.lock:
+            self.advance()
+            return self.values.get(pin, 0.0)
+
+    def write(self, pin, value):
+        # Outputs are not part of a trace
+        pass
+
+
+def attach(recorder):
+    """Records every ADC and switch read from now on, pass None to stop"""
+    import hardware
+    hardware.recorder = recorder
+
+
+if __name__ == '__main__':
+    import sys
+
+    reader = TraceReader(sys.argv[1])
+    print('%d records of %s over %.1f s' % (len(reader), ', '.join(reader.channels), reader.duration))
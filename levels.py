@@ -0,0 +1,310 @@
+"""This module loads the declarative level files, e.g. levels.json.
+
+A level file describes the devices, the wiring and the states. It is validated when loaded, State objects
+are only built on request and every device is created on its first use, so loading touches no hardware.
+"""
+import json
+import time
+from threading import Lock
+
+from conditions import AnalogCondition, DigitalCondition, Above, Below, Within, Is, All, Any, Not, Hold
+from filters import MovingAverage, ExponentialMovingAverage, RollingMedian
+from helpers import cavity_resonant_blinking, kick_out_atom, blink_randomly, blink_alternating, blink_together
+from wiring import Wire, Wiring
+
+actions = {'cavity_resonant_blinking': cavity_resonant_blinking,
+           'kick_out_atom': kick_out_atom,
+           'blink_randomly': blink_randomly,
+           'blink_alternating': blink_alternating,
+           'blink_together': blink_together,
+           'sleep': time.sleep,
+           'print': print}
+
+filters = {'moving_average': MovingAverage,
+           'exponential_moving_average': ExponentialMovingAverage,
+           'rolling_median': RollingMedian}
+
+device_types = ('adc', 'switch', 'led', 'servo')
+motion_limits = ('max_velocity', 'max_acceleration', 'smoothing', 'deadband')
+input_types = ('adc', 'switch')
+# Conditions of the condition language, they are compiled when the states are built
+expression_types = ('above', 'below', 'within', 'is', 'all', 'any', 'not', 'hold')
+
+
+class LazyDevice:
+    """Stands in for a device and creates it on the first access of anything but its name and pin"""
+    def __init__(self, name, pin, factory):
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'pin', pin)
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_device', None)
+        object.__setattr__(self, '_lock', Lock())
+
+    @property
+    def created(self):
+        return self._device is not None
+
+    def resolve(self):
+        if self._device is None:
+            with self._lock:
+                if self._device is None:
+                    object.__setattr__(self, '_device', self._factory())
+        return self._device
+
+    def __getattr__(self, attribute):
+        return getattr(self.resolve(), attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(self.resolve(), attribute, value)
+
+    def __repr__(self):
+        return '<LazyDevice %s on %s%s>' % (self.name, self.pin, '' if self.created else ', not created')
+
+
+class DeviceRegistry:
+    def __init__(self, specs, mock_hardware=False, sampler=None, backend=None):
+        self.specs = specs
+        self.mock_hardware = mock_hardware
+        self.sampler = sampler
+        self.backend = backend
+        self.devices = {name: LazyDevice(name, spec['pin'], self.factory(spec)) for name, spec in specs.items()}
+
+    def __getitem__(self, name):
+        return self.devices[name]
+
+    def __iter__(self):
+        return iter(self.devices.values())
+
+    def factory(self, spec):
+        def create():
+            # Imported here, so that loading a level file never needs the hardware libraries
+            from hardware import ADC, Switch, LED, Servo
+            if spec['type'] == 'adc':
+                sample_filter = None
+                if 'filter' in spec:
+                    options = dict(spec['filter'])
+                    sample_filter = filters[options.pop('type')](**options)
+                return ADC(spec['pin'], average_samples=spec.get('average_samples'),
+                           mock_hardware=self.mock_hardware, sampler=self.sampler, sample_filter=sample_filter,
+                           backend=self.backend)
+            if spec['type'] == 'switch':
+                return Switch(spec['pin'], mock_hardware=self.mock_hardware, sampler=self.sampler,
+                              backend=self.backend)
+            if spec['type'] == 'led':
+                return LED(spec['pin'], mock_hardware=self.mock_hardware, backend=self.backend)
+            servo = Servo(spec['pin'], min_duty=spec.get('min_duty', 4.0), max_duty=spec.get('max_duty', 15.0),
+                          mock_hardware=self.mock_hardware, backend=self.backend)
+            if 'motion' in spec:
+                from motion import motion
+                return motion.attach(servo, **spec['motion'])
+            return servo
+        return create
+
+
+class LevelTable:
+    def __init__(self, spec, path='<levels>'):
+        self.spec = spec
+        self.path = path
+        validate(spec, path)
+        self.hold_time = spec.get('hold_time', 3)
+        self.sample_rate = spec.get('sample_rate', 500.0)
+        self.wiring_rate = spec.get('wiring_rate', 50.0)
+        self.devices = spec['devices']
+
+    def registry(self, mock_hardware=False, sampler=None, backend=None):
+        return DeviceRegistry(self.devices, mock_hardware=mock_hardware, sampler=sampler, backend=backend)
+
+    def build_condition(self, spec, devices, debug):
+        if spec is False or spec is True:
+            return spec
+        if spec['type'] == 'digital':
+            return DigitalCondition(devices[spec['input']], fullfilled_if_on=spec.get('on', True), debug=debug)
+        if spec['type'] in expression_types:
+            return self.build_expression(spec, devices).compile()
+        return AnalogCondition(devices[spec['input']], threshold=spec.get('threshold', 0.0),
+                               equal_epsilon=spec.get('equal_epsilon', 0.01), condition=spec['condition'],
+                               hold_true=spec.get('hold_true', self.hold_time), debug=debug)
+
+    def build_expression(self, spec, devices):
+        kind = spec['type']
+        if kind in ('all', 'any'):
+            expressions = [self.build_expression(inner, devices) for inner in spec['conditions']]
+            return All(*expressions) if kind == 'all' else Any(*expressions)
+        if kind == 'not':
+            return Not(self.build_expression(spec['condition'], devices))
+        if kind == 'hold':
+            return Hold(self.build_expression(spec['condition'], devices), spec.get('seconds', self.hold_time))
+        device = devices[spec['input']]
+        if kind == 'above':
+            return Above(device, spec['threshold'])
+        if kind == 'below':
+            return Below(device, spec['threshold'])
+        if kind == 'within':
+            return Within(device, spec['center'], spec.get('epsilon', 0.01))
+        return Is(device, spec.get('on', True))
+
+    @staticmethod
+    def build_actions(specs, devices):
+        if specs is None:
+            return None
+        built = []
+        for spec in specs:
+            if 'devices' in spec:
+                params = tuple(devices[name] for name in spec['devices'])
+                if len(params) == 1:
+                    params = params[0]
+            else:
+                params = spec.get('params')
+            built.append((actions[spec['action']], params))
+        return built
+
+    def build_states(self, devices=None, debug=False, state_class=None):
+        """state_class defaults to game.State, Game passes its own so that it also works when run as __main__"""
+        if state_class is None:
+            from game import State as state_class
+        if devices is None:
+            devices = self.registry()
+        states = {}
+        for spec in self.spec['states']:
+            states[spec['id']] = state_class(spec['name'], self.build_condition(spec['condition'], devices, debug),
+                                             enter_actions=self.build_actions(spec.get('enter_actions'), devices),
+                                             leave_actions=self.build_actions(spec.get('leave_actions'), devices),
+                                             random_actions=self.build_actions(spec.get('random_actions'), devices),
+                                             parallel_actions=self.build_actions(spec.get('parallel_actions'), devices),
+                                             next_states=list(spec['next_states']),
+                                             fail_probability=spec.get('fail_probability', 0.0))
+        return states
+
+    def build_wiring(self, devices, wakeup=None):
+        wires = [Wire(devices[spec['source']], devices[spec['target']], spec['attribute'],
+                      deadband=spec.get('deadband'), rate=spec.get('rate'))
+                 for spec in self.spec.get('wiring', [])]
+        return Wiring(wires, rate=self.wiring_rate, wakeup=wakeup)
+
+
+def fail(path, location, message):
+    raise ValueError('%s: %s: %s' % (path, location, message))
+
+
+def validate(spec, path='<levels>'):
+    if not isinstance(spec, dict):
+        fail(path, 'top level', 'expected an object')
+    devices = spec.get('devices')
+    if not isinstance(devices, dict) or not devices:
+        fail(path, 'devices', 'expected a non empty object')
+    for name, device in devices.items():
+        location = 'devices.%s' % name
+        if not isinstance(device, dict) or device.get('type') not in device_types:
+            fail(path, location, 'type has to be one of %s' % ', '.join(device_types))
+        if not isinstance(device.get('pin'), str):
+            fail(path, location, 'pin is missing')
+        if 'filter' in device and (not isinstance(device['filter'], dict) or
+                                   device['filter'].get('type') not in filters):
+            fail(path, location, 'filter type has to be one of %s' % ', '.join(filters))
+        if 'motion' in device:
+            if not isinstance(device['motion'], dict):
+                fail(path, location + '.motion', 'expected an object')
+            if device['type'] != 'servo':
+                fail(path, location, 'only servos can have motion limits')
+            for key, value in device['motion'].items():
+                if key not in motion_limits or not isinstance(value, (int, float)) or value < 0:
+                    fail(path, location + '.motion', '%s has to be one of %s with a positive value' %
+                         (key, ', '.join(motion_limits)))
+
+    def check_device(location, name, types):
+        if not isinstance(name, str) or name not in devices:
+            fail(path, location, 'unknown device %s' % name)
+        if devices[name]['type'] not in types:
+            fail(path, location, '%s is no %s' % (name, ' or '.join(types)))
+
+    def check_number(location, condition, key, required=True):
+        if key not in condition and not required:
+            return
+        if isinstance(condition.get(key), bool) or not isinstance(condition.get(key), (int, float)):
+            fail(path, location, '%s has to be a number' % key)
+
+    def check_condition(location, condition):
+        kinds = ('analog', 'digital') + expression_types
+        if not isinstance(condition, dict) or condition.get('type') not in kinds:
+            fail(path, location, 'expected true, false or a condition of type %s' % ', '.join(kinds))
+        kind = condition['type']
+        if kind in ('all', 'any'):
+            inner = condition.get('conditions')
+            if not isinstance(inner, list) or not inner:
+                fail(path, location + '.conditions', 'expected a non empty list')
+            for index, expression in enumerate(inner):
+                check_condition('%s.conditions[%d]' % (location, index), expression)
+        elif kind in ('not', 'hold'):
+            if kind == 'hold':
+                check_number(location, condition, 'seconds', required=False)
+            check_condition(location + '.condition', condition.get('condition'))
+        elif kind in ('digital', 'is'):
+            check_device(location + '.input', condition.get('input'), ('switch',))
+        else:
+            check_device(location + '.input', condition.get('input'), ('adc',))
+            if kind == 'analog' and condition.get('condition') not in AnalogCondition.comparison_operators:
+                fail(path, location, 'condition has to be one of %s' %
+                     ', '.join(AnalogCondition.comparison_operators))
+            if kind in ('above', 'below'):
+                check_number(location, condition, 'threshold')
+            elif kind == 'within':
+                check_number(location, condition, 'center')
+                check_number(location, condition, 'epsilon', required=False)
+
+    wiring = spec.get('wiring', [])
+    if not isinstance(wiring, list):
+        fail(path, 'wiring', 'expected a list')
+    for index, wire in enumerate(wiring):
+        location = 'wiring[%d]' % index
+        if not isinstance(wire, dict):
+            fail(path, location, 'expected an object')
+        check_device(location + '.source', wire.get('source'), input_types)
+        check_device(location + '.target', wire.get('target'), ('led', 'servo'))
+        if wire.get('attribute') not in ('state', 'angle'):
+            fail(path, location, 'attribute has to be state or angle')
+
+    states = spec.get('states')
+    if not isinstance(states, list) or not states:
+        fail(path, 'states', 'expected a non empty list')
+    for index, state in enumerate(states):
+        if not isinstance(state, dict):
+            fail(path, 'states[%d]' % index, 'expected an object')
+    ids = [state.get('id') for state in states]
+    if 0 not in ids:
+        fail(path, 'states', 'the game starts in state 0, which is missing')
+    for index, state in enumerate(states):
+        location = 'states[%d]' % index
+        if not isinstance(state.get('id'), int) or ids.count(state['id']) != 1:
+            fail(path, location, 'id has to be a unique integer')
+        if not isinstance(state.get('name'), str):
+            fail(path, location, 'name is missing')
+        next_states = state.get('next_states')
+        if not isinstance(next_states, list) or len(next_states) != 2:
+            fail(path, location, 'next_states has to be [next state, fail state]')
+        if next_states[0] not in ids or (next_states[1] not in ids and next_states[1] != 99):
+            fail(path, location, 'next_states refers to an unknown state')
+        condition = state.get('condition')
+        if not isinstance(condition, bool):
+            check_condition(location + '.condition', condition)
+        for key in ('enter_actions', 'leave_actions', 'random_actions', 'parallel_actions'):
+            if not isinstance(state.get(key, []), list):
+                fail(path, '%s.%s' % (location, key), 'expected a list')
+            for action_index, action in enumerate(state.get(key, [])):
+                action_location = '%s.%s[%d]' % (location, key, action_index)
+                if not isinstance(action, dict):
+                    fail(path, action_location, 'expected an object')
+                if action.get('action') not in actions:
+                    fail(path, action_location, 'unknown action %s' % action.get('action'))
+                if not isinstance(action.get('devices', []), list):
+                    fail(path, action_location + '.devices', 'expected a list')
+                for name in action.get('devices', []):
+                    check_device(action_location, name, device_types)
+
+
+def load_levels(path='levels.json'):
+    with open(path) as fh:
+        try:
+            spec = json.load(fh)
+        except ValueError as error:
+            raise ValueError('%s: %s' % (path, error))
+    return LevelTable(spec, path)
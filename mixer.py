@@ -0,0 +1,420 @@
+"""This module provides an in-process sound engine which mixes WAV clips from a cached library into one output sink"""
+import json
+import os
+import re
+import subprocess
+import time
+import warnings
+import wave
+from collections import OrderedDict
+from threading import Thread, Condition, Lock
+
+with warnings.catch_warnings():
+    # audioop is deprecated, but where it exists it is by far the fastest way to mix
+    warnings.simplefilter('ignore', DeprecationWarning)
+    try:
+        import audioop
+    except ImportError:
+        audioop = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EFFECT_PRIORITY = 0
+INSULT_PRIORITY = 0
+STAGE_PRIORITY = 10
+
+
+class Clip:
+    def __init__(self, name, frames, rate, channels, sampwidth):
+        self.name = name
+        self.frames = frames
+        self.rate = rate
+        self.channels = channels
+        self.sampwidth = sampwidth
+
+    @property
+    def format(self):
+        return self.rate, self.channels, self.sampwidth
+
+    @property
+    def duration(self):
+        return len(self.frames) / float(self.rate * self.channels * self.sampwidth)
+
+    @classmethod
+    def load(cls, path):
+        with wave.open(path, 'rb') as fh:
+            frames = fh.readframes(fh.getnframes())
+            return cls(os.path.basename(path), frames, fh.getframerate(), fh.getnchannels(), fh.getsampwidth())
+
+
+class SoundLibrary:
+    """Index of a sound folder with an LRU cache of decoded clips.
+
+    Only the WAV headers are read to build the index, which is kept in a manifest next to the sounds and reused
+    as long as no file changed. Clips are decoded on first use and the least recently used ones are dropped
+    once the cache exceeds cache_bytes.
+    """
+    manifest_name = '.manifest.json'
+    categories = {'E': 'effect', 'I': 'insult', 'S': 'stage'}
+    name_pattern = re.compile(r'^(?P<category>[EIS])(?P<number>\d*)')
+
+    def __init__(self, soundfolder, cache_bytes=8 * 1024 * 1024):
+        self.soundfolder = soundfolder
+        self.cache_bytes = cache_bytes
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self.format = None
+        self.skipped = {}
+        self.entries = self.load_index()
+        self.effects = self.names('effect')
+        self.insults = self.names('insult')
+        # Keyed by the stage number in the name, S10 is stage 10, stage sounds without a number are never played
+        self.stagesounds = {}
+        for name in self.names('stage'):
+            if self.entries[name]['number'] is not None:
+                self.stagesounds.setdefault(self.entries[name]['number'], name)
+        self.random_pool = tuple(self.insults + self.effects)
+
+    def names(self, category):
+        return [name for name in sorted(self.entries) if self.entries[name]['category'] == category]
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __iter__(self):
+        return iter(sorted(self.entries))
+
+    def load_index(self):
+        files = {}
+        for name in os.listdir(self.soundfolder):
+            if name.endswith('.wav'):
+                stat = os.stat(os.path.join(self.soundfolder, name))
+                files[name] = [stat.st_size, stat.st_mtime]
+        manifest_path = os.path.join(self.soundfolder, self.manifest_name)
+        try:
+            with open(manifest_path) as fh:
+                manifest = json.load(fh)
+            # Files the last scan skipped are listed as well, otherwise a single bad file forces a rescan every time
+            indexed = {name: entry['stat'] for name, entry in manifest['entries'].items()}
+            indexed.update(manifest['skipped'])
+            if indexed == files:
+                self.format = tuple(manifest['format']) if manifest['format'] else None
+                self.skipped = manifest['skipped']
+                return manifest['entries']
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
+        entries = self.scan(sorted(files), files)
+        try:
+            with open(manifest_path, 'w') as fh:
+                json.dump({'format': self.format, 'entries': entries, 'skipped': self.skipped}, fh, indent=1)
+        except IOError as error:
+            print('Could not write sound manifest %s: %s' % (manifest_path, error))
+        return entries
+
+    def scan(self, names, files):
+        entries = {}
+        for name in names:
+            try:
+                with wave.open(os.path.join(self.soundfolder, name), 'rb') as fh:
+                    clip_format = (fh.getframerate(), fh.getnchannels(), fh.getsampwidth())
+                    size = fh.getnframes() * fh.getnchannels() * fh.getsampwidth()
+            except (wave.Error, EOFError) as error:
+                print('Could not load %s: %s' % (name, error))
+                self.skipped[name] = files[name]
+                continue
+            if self.format is None:
+                self.format = clip_format
+            if clip_format != self.format:
+                print('Skipping %s, its format %s differs from %s' % (name, clip_format, self.format))
+                self.skipped[name] = files[name]
+                continue
+            match = self.name_pattern.match(name)
+            entries[name] = {'category': self.categories[match.group('category')] if match else None,
+                             'number': int(match.group('number')) if match and match.group('number') else None,
+                             'bytes': size,
+                             'stat': files[name]}
+        return entries
+
+    def clip(self, name):
+        """Returns the decoded clip, raises KeyError for sounds which are not in the library"""
+        entry = self.entries[name]
+        with self._lock:
+            clip = self.cache.get(name)
+            if clip is not None:
+                self.cache.move_to_end(name)
+                self.hits += 1
+                return clip
+        # Decoded outside the lock, a slow SD card must not block the hits of other clips
+        clip = Clip.load(os.path.join(self.soundfolder, name))
+        with self._lock:
+            self.misses += 1
+            if name not in self.cache:
+                self.cache[name] = clip
+                self.cached_bytes += len(clip.frames)
+            while self.cached_bytes > self.cache_bytes and len(self.cache) > 1:
+                _, evicted = self.cache.popitem(last=False)
+                self.cached_bytes -= len(evicted.frames)
+        return clip
+
+    def preload(self, names):
+        for name in names:
+            self.clip(name)
+
+    @property
+    def metrics(self):
+        return {'clips': len(self.entries), 'cached': len(self.cache), 'cached_bytes': self.cached_bytes,
+                'hits': self.hits, 'misses': self.misses}
+
+
+class Voice:
+    def __init__(self, clip, priority):
+        self.clip = clip
+        self.priority = priority
+        self.position = 0
+        self.cancelled = False
+        self.finished = False
+        self._done = Condition()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def finish(self):
+        with self._done:
+            self.finished = True
+            self._done.notify_all()
+
+    def wait(self, timeout=None):
+        with self._done:
+            return self._done.wait_for(lambda: self.finished, timeout=timeout)
+
+
+class NullSink:
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self.bytes_written = 0
+        self.bytes_per_second = 0
+
+    def open(self, rate, channels, sampwidth):
+        self.bytes_per_second = rate * channels * sampwidth
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        if self.realtime:
+            time.sleep(len(data) / float(self.bytes_per_second))
+
+    def close(self):
+        pass
+
+
+class FileSink(NullSink):
+    def __init__(self, path, realtime=False):
+        super(FileSink, self).__init__(realtime)
+        self.path = path
+        self.fh = None
+
+    def open(self, rate, channels, sampwidth):
+        super(FileSink, self).open(rate, channels, sampwidth)
+        self.fh = wave.open(self.path, 'wb')
+        self.fh.setframerate(rate)
+        self.fh.setnchannels(channels)
+        self.fh.setsampwidth(sampwidth)
+
+    def write(self, data):
+        self.fh.writeframes(data)
+        super(FileSink, self).write(data)
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+
+class AplaySink:
+    """One persistent aplay process fed with raw PCM, writes block at playback speed"""
+    formats = {1: 'U8', 2: 'S16_LE', 4: 'S32_LE'}
+
+    def __init__(self, device='default:CARD=Device'):
+        self.device = device
+        self.process = None
+        self.format = None
+        self.failed = False
+
+    def open(self, rate, channels, sampwidth):
+        self.format = (rate, channels, sampwidth)
+
+    def start_process(self):
+        rate, channels, sampwidth = self.format
+        self.process = subprocess.Popen(['aplay', '--device=%s' % self.device, '-t', 'raw',
+                                         '-f', AplaySink.formats[sampwidth], '-r', str(rate), '-c', str(channels)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def write(self, data):
+        if self.process is None or self.process.poll() is not None:
+            try:
+                self.start_process()
+            except OSError as error:
+                if not self.failed:
+                    print('Could not start aplay, sounds are dropped: %s' % error)
+                self.failed = True
+                self.process = None
+                # Drop the chunk at playback speed, so voices still take as long as they would have sounded
+                rate, channels, sampwidth = self.format
+                time.sleep(len(data) / float(rate * channels * sampwidth))
+                return
+            self.failed = False
+        try:
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            print('aplay died, restarting it with the next chunk')
+            self.process = None
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process = None
+
+
+# NumPy type and bias of the samples for each sample width, 8 bit WAVs are unsigned
+sample_types = {1: ('u1', 128), 2: ('<i2', 0), 4: ('<i4', 0)}
+
+
+def mix(fragments, sampwidth):
+    mixed = fragments[0]
+    if len(fragments) == 1:
+        return mixed
+    if audioop is not None:
+        if sampwidth == 1:
+            # 8 bit WAVs are unsigned, audioop adds signed samples
+            fragments = [audioop.bias(fragment, 1, -128) for fragment in fragments]
+            mixed = fragments[0]
+        for fragment in fragments[1:]:
+            mixed = audioop.add(mixed, fragment, sampwidth)
+        return audioop.bias(mixed, 1, 128) if sampwidth == 1 else mixed
+    if np is None or sampwidth not in sample_types:
+        # Mixing sample by sample in Python cannot keep up with playback, the highest priority voice wins
+        return mixed
+    dtype, offset = sample_types[sampwidth]
+    mixed = np.zeros(len(mixed) // sampwidth, dtype=np.int64)
+    for fragment in fragments:
+        mixed += np.frombuffer(fragment, dtype=dtype).astype(np.int64) - offset
+    limit = 2 ** (8 * sampwidth - 1)
+    return (np.clip(mixed, -limit, limit - 1) + offset).astype(dtype).tobytes()
+
+
+class SoundEngine:
+    def __init__(self, soundfolder, sink=None, chunk_frames=1024, library=None, cache_bytes=8 * 1024 * 1024):
+        self.soundfolder = soundfolder
+        self.sink = sink if sink is not None else AplaySink()
+        self.chunk_frames = chunk_frames
+        if library is None:
+            library = SoundLibrary(soundfolder, cache_bytes=cache_bytes)
+        self.library = library
+        self.format = library.format
+        self.voices = []
+        self.condition = Condition()
+        self.running = False
+        self.thread = None
+
+    @property
+    def chunk_bytes(self):
+        rate, channels, sampwidth = self.format
+        return self.chunk_frames * channels * sampwidth
+
+    def start(self):
+        if self.running or self.format is None:
+            return
+        self.running = True
+        self.sink.open(*self.format)
+        self.thread = Thread(target=self.mix_loop, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    def shutdown(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        self.sink.close()
+
+    def play(self, name, priority=EFFECT_PRIORITY, preempt=True):
+        """Starts a clip right away, cutting off all voices of lower priority if preempt is set"""
+        try:
+            clip = self.library.clip(name)
+        except KeyError:
+            print('Sound %s is not in the library' % name)
+            return None
+        except (IOError, wave.Error, EOFError) as error:
+            print('Could not load %s: %s' % (name, error))
+            return None
+        self.start()
+        voice = Voice(clip, priority)
+        with self.condition:
+            if preempt:
+                for playing in self.voices:
+                    if playing.priority < priority:
+                        playing.cancel()
+            self.voices.append(voice)
+            self.condition.notify_all()
+        return voice
+
+    def stop(self, max_priority=None):
+        """Cancels all voices, or only those with a priority up to max_priority"""
+        with self.condition:
+            for voice in self.voices:
+                if max_priority is None or voice.priority <= max_priority:
+                    voice.cancel()
+
+    @property
+    def playing(self):
+        return [voice.clip.name for voice in self.voices if not voice.cancelled]
+
+    def next_chunk(self):
+        with self.condition:
+            while self.running and not self.voices:
+                self.condition.wait()
+            if not self.running:
+                return None
+            for voice in [voice for voice in self.voices if voice.cancelled]:
+                self.voices.remove(voice)
+                voice.finish()
+            voices = sorted(self.voices, key=lambda voice: -voice.priority)
+        if not voices:
+            return b''
+        size = self.chunk_bytes
+        # Unsigned 8 bit samples are silent at their midpoint
+        silence = b'\x80' if self.format[2] == 1 else b'\0'
+        fragments = []
+        for voice in voices:
+            fragment = voice.clip.frames[voice.position:voice.position + size]
+            voice.position += size
+            if len(fragment) < size:
+                fragment += silence * (size - len(fragment))
+                voice.cancel()
+            fragments.append(fragment)
+        return mix(fragments, self.format[2])
+
+    def mix_loop(self):
+        try:
+            while self.running:
+                chunk = self.next_chunk()
+                if chunk:
+                    self.sink.write(chunk)
+        except Exception as error:
+            # Nobody waiting on a voice may hang because the sink broke
+            print('Sound engine stopped: %s' % error)
+            self.running = False
+        finally:
+            with self.condition:
+                for voice in self.voices:
+                    voice.finish()
+                self.voices = []
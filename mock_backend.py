@@ -0,0 +1,110 @@
+"""This module provides the shared memory backend used with mock_hardware=True.
+
+All mocked pins live in one memory-mapped file with a fixed-size binary slot per pin, so the game
+and the mock GUI exchange values without any file syscalls per sample.
+Every slot carries a sequence counter which is odd while a write is in progress, readers use it to detect torn reads.
+"""
+import mmap
+import os
+import struct
+
+MAGIC = b'HGMK'
+HEADER = struct.Struct('<4sII4x')
+SLOT = struct.Struct('<16sI4xd')
+SEQUENCE = struct.Struct('<I')
+VALUE = struct.Struct('<d')
+NAME_LENGTH = 16
+
+
+class MockBackend:
+    def __init__(self, path='hardware_files/mock_hardware.bin', slots=64, check_sequence=True):
+        self.path = path
+        self.slots = slots
+        self.check_sequence = check_sequence
+        self.size = HEADER.size + slots * SLOT.size
+        self._offsets = {}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        if os.fstat(self.fd).st_size < self.size:
+            os.ftruncate(self.fd, self.size)
+        self.memory = mmap.mmap(self.fd, self.size)
+        magic, version, slots = HEADER.unpack_from(self.memory, 0)
+        if magic != MAGIC:
+            HEADER.pack_into(self.memory, 0, MAGIC, 1, self.slots)
+        elif slots != self.slots:
+            raise ValueError('%s was created with %d slots, not %d' % (self.path, slots, self.slots))
+
+    def close(self):
+        self.memory.close()
+        os.close(self.fd)
+
+    def offset(self, pin):
+        try:
+            return self._offsets[pin]
+        except KeyError:
+            pass
+        name = pin.encode('ascii')
+        if len(name) > NAME_LENGTH:
+            raise ValueError('Pin name %s is longer than %d characters' % (pin, NAME_LENGTH))
+        free_offset = None
+        for index in range(self.slots):
+            offset = HEADER.size + index * SLOT.size
+            slot_name = bytes(self.memory[offset:offset + NAME_LENGTH]).rstrip(b'\0')
+            if slot_name == name:
+                self._offsets[pin] = offset
+                return offset
+            if not slot_name and free_offset is None:
+                free_offset = offset
+        if free_offset is None:
+            raise IndexError('No free slot left in %s for %s' % (self.path, pin))
+        SLOT.pack_into(self.memory, free_offset, name, 0, 0.0)
+        self._offsets[pin] = free_offset
+        return free_offset
+
+    @property
+    def pins(self):
+        pins = []
+        for index in range(self.slots):
+            offset = HEADER.size + index * SLOT.size
+            name = bytes(self.memory[offset:offset + NAME_LENGTH]).rstrip(b'\0')
+            if name:
+                pins.append(name.decode('ascii'))
+        return pins
+
+    def read(self, pin, retries=100):
+        offset = self.offset(pin)
+        sequence_offset = offset + NAME_LENGTH
+        value_offset = sequence_offset + 8
+        if not self.check_sequence:
+            return VALUE.unpack_from(self.memory, value_offset)[0]
+        for _ in range(retries):
+            sequence = SEQUENCE.unpack_from(self.memory, sequence_offset)[0]
+            if sequence & 1:
+                continue
+            value = VALUE.unpack_from(self.memory, value_offset)[0]
+            if SEQUENCE.unpack_from(self.memory, sequence_offset)[0] == sequence:
+                return value
+        raise IOError('Could not get a consistent read of %s' % pin)
+
+    def write(self, pin, value):
+        offset = self.offset(pin)
+        sequence_offset = offset + NAME_LENGTH
+        sequence = SEQUENCE.unpack_from(self.memory, sequence_offset)[0]
+        SEQUENCE.pack_into(self.memory, sequence_offset, (sequence + 1) & 0xffffffff)
+        VALUE.pack_into(self.memory, sequence_offset + 8, float(value))
+        SEQUENCE.pack_into(self.memory, sequence_offset, (sequence + 2) & 0xffffffff)
+
+    def sequence(self, pin):
+        return SEQUENCE.unpack_from(self.memory, self.offset(pin) + NAME_LENGTH)[0]
+
+
+_shared_backend = None
+
+
+def shared_backend():
+    global _shared_backend
+    if _shared_backend is None:
+        _shared_backend = MockBackend()
+    return _shared_backend
@@ -1,63 +1,110 @@
 import sys
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QObject, pyqtSignal
 from PyQt5.QtWidgets import QApplication, QVBoxLayout, QHBoxLayout, QWidget, QSlider, QLabel, QPushButton
 
+from mock_server import MockClient, DEFAULT_PATH
+
 
 class ADCControl(QWidget):
-    def __init__(self, file_name='Test'):
+    def __init__(self, client, channel):
         super(ADCControl, self).__init__()
+        self.client = client
+        self.pin = channel['pin']
         self.slider = QSlider(Qt.Vertical)
+        self.slider.setValue(int(round(client.values.get(self.pin, 0.0) * 100)))
         self.slider.valueChanged.connect(self.update_adc)
-        self.path = 'hardware_files/%s' % file_name
-        self.fh = open(self.path, 'w')
         self.label = QLabel()
         self.lay = QVBoxLayout()
         self.lay.addWidget(self.slider)
         self.lay.addWidget(self.label)
+        self.lay.addWidget(QLabel(channel['name']))
         self.setLayout(self.lay)
-        self.label.setText('0.0')
+        self.show_value(client.values.get(self.pin, 0.0))
 
     def update_adc(self, p_int):
-        value = float(p_int) / 100.0
-        self.label.setText(str(value))
-        self.fh.seek(0)
-        self.fh.truncate()
-        self.fh.write('%.2f' % value)
-        self.fh.flush()
-        print(value)
+        self.client.set(self.pin, float(p_int) / 100.0)
+
+    def show_value(self, value):
+        self.label.setText('%.2f' % value)
+        if not self.slider.isSliderDown():
+            self.slider.blockSignals(True)
+            self.slider.setValue(int(round(value * 100)))
+            self.slider.blockSignals(False)
+
 
 class ToggleButton(QPushButton):
-    def __init__(self, name):
-        super(ToggleButton, self).__init__(name)
+    def __init__(self, client, channel):
+        super(ToggleButton, self).__init__(channel['name'])
         self.setCheckable(True)
-        self.path = 'hardware_files/%s' % name
-        self.fh = open(self.path, 'w')
+        self.client = client
+        self.pin = channel['pin']
+        self.setChecked(bool(client.values.get(self.pin)))
         self.clicked.connect(self.click)
 
     def click(self, bool=False):
-        self.fh.seek(0)
-        self.fh.truncate()
-        self.fh.write('1' if bool else '0')
-        self.fh.flush()
+        self.client.set(self.pin, 1.0 if bool else 0.0)
+
+    def show_value(self, value):
+        self.setChecked(bool(value))
+
+
+class Indicator(QLabel):
+    """Shows an output of the game, LEDs as on/off and servos as angle"""
+    def __init__(self, client, channel):
+        super(Indicator, self).__init__()
+        self.channel = channel
+        self.show_value(client.values.get(channel['pin'], 0.0))
+
+    def show_value(self, value):
+        if self.channel['type'] == 'led':
+            text = 'on' if value else 'off'
+        elif value:
+            # Mocked servos report their duty cycle
+            duty_range = self.channel['max_duty'] - self.channel['min_duty']
+            text = '%.2f' % ((value - self.channel['min_duty']) / duty_range)
+        else:
+            text = '-'
+        self.setText('%s: %s' % (self.channel['name'], text))
+
+
+class Changes(QObject):
+    # Changes arrive on the client thread and are handed to the GUI thread by the signal
+    changed = pyqtSignal(str, float)
 
 
 class Window(QWidget):
-    def __init__(self, parent=None):
+    def __init__(self, path=DEFAULT_PATH, parent=None):
         super(Window, self).__init__(parent)
+        self.changes = Changes()
+        self.changes.changed.connect(self.show_change)
+        self.client = MockClient(path, on_change=self.changes.changed.emit)
+        self.controls = {}
 
         self.layout = QHBoxLayout()
-        self.layout.addWidget(ADCControl('AIN0'))
-        self.layout.addWidget(ADCControl('AIN1'))
-        self.layout.addWidget(ADCControl('AIN2'))
-        self.layout.addWidget(ADCControl('AIN3'))
-        self.layout.addWidget(ToggleButton('SWPin'))
+        outputs = QVBoxLayout()
+        for channel in self.client.channels:
+            if channel['type'] == 'adc':
+                control = ADCControl(self.client, channel)
+                self.layout.addWidget(control)
+            elif channel['type'] == 'switch':
+                control = ToggleButton(self.client, channel)
+                self.layout.addWidget(control)
+            else:
+                control = Indicator(self.client, channel)
+                outputs.addWidget(control)
+            self.controls[channel['pin']] = control
+        self.layout.addLayout(outputs)
         self.setLayout(self.layout)
 
+    def show_change(self, pin, value):
+        if pin in self.controls:
+            self.controls[pin].show_value(value)
+
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
-    w = Window()
+    w = Window(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PATH)
     w.resize(250, 150)
     w.show()
     sys.exit(app.exec_())
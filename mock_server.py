@@ -0,0 +1,256 @@
+"""This module serves the mocked devices of a level file to panels and scripted clients over a UNIX socket.
+
+The values themselves stay in the shared memory of the mock backend, the server only watches its sequence counters
+and pushes every change as one JSON line to all connected clients. Clients set inputs with a JSON line as well:
+
+    {"set": "AIN4", "value": 0.3}
+
+    python mock_server.py levels.json                  serves the devices, e.g. next to a game started elsewhere
+    python mock_server.py levels.json --drive 60       additionally drives all inputs randomly for 60 s
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import time
+from threading import Thread, RLock, Condition
+
+from levels import load_levels
+from mock_backend import shared_backend
+
+DEFAULT_PATH = '/tmp/hatgame_mock.sock'
+
+
+def channels(levels):
+    """Describes every device of a level table, so clients can build their controls from it"""
+    described = []
+    for name, spec in sorted(levels.devices.items(), key=lambda item: item[1]['pin']):
+        channel = {'name': name, 'pin': spec['pin'], 'type': spec['type']}
+        if spec['type'] == 'servo':
+            channel['min_duty'] = spec.get('min_duty', 4.0)
+            channel['max_duty'] = spec.get('max_duty', 15.0)
+        described.append(channel)
+    return described
+
+
+class MockServer:
+    def __init__(self, levels, backend=None, path=DEFAULT_PATH, poll_interval=0.005, send_timeout=0.5):
+        self.channels = channels(levels)
+        self.backend = backend if backend is not None else shared_backend()
+        self.path = path
+        self.poll_interval = poll_interval
+        self.send_timeout = send_timeout
+        self.clients = []
+        self.clients_lock = RLock()
+        self.server = None
+        self.threads = []
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+        for channel in self.channels:
+            # Creates the slots up front, so every channel is watched from the start
+            self.backend.offset(channel['pin'])
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen(8)
+        self.running = True
+        self.threads = []
+        for target in (self.accept_loop, self.watch_loop):
+            thread = Thread(target=target, args=())
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        try:
+            # Wakes up the blocked accept(), closing alone does not on every platform
+            self.server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+        self.threads = []
+        self.server.close()
+        self.remove_socket()
+        with self.clients_lock:
+            for connection in self.clients:
+                connection.close()
+            self.clients = []
+
+    def remove_socket(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def values(self):
+        return {channel['pin']: self.backend.read(channel['pin']) for channel in self.channels}
+
+    def send(self, connection, message):
+        try:
+            connection.sendall((json.dumps(message) + '\n').encode('utf-8'))
+            return True
+        except OSError:
+            # A client which does not keep up is dropped instead of stalling all others
+            with self.clients_lock:
+                if connection in self.clients:
+                    self.clients.remove(connection)
+            connection.close()
+            return False
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                break
+            if not self.running:
+                connection.close()
+                break
+            # The timeout only bounds how long a slow client can hold up the pushes
+            connection.settimeout(self.send_timeout)
+            with self.clients_lock:
+                # Registered before the values are read, so no change falls in between
+                self.clients.append(connection)
+                connected = self.send(connection, {'channels': self.channels, 'values': self.values()})
+            if connected:
+                thread = Thread(target=self.client_loop, args=(connection,))
+                thread.daemon = True
+                thread.start()
+
+    def client_loop(self, connection):
+        buffered = b''
+        while self.running:
+            try:
+                data = connection.recv(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if not data:
+                break
+            *lines, buffered = (buffered + data).split(b'\n')
+            for line in lines:
+                try:
+                    message = json.loads(line.decode('utf-8'))
+                    self.backend.write(message['set'], float(message['value']))
+                except (ValueError, KeyError, TypeError) as error:
+                    print('Ignoring mock client message %r: %s' % (line, error))
+        with self.clients_lock:
+            if connection in self.clients:
+                self.clients.remove(connection)
+
+    def watch_loop(self):
+        sequences = {channel['pin']: self.backend.sequence(channel['pin']) for channel in self.channels}
+        while self.running:
+            time.sleep(self.poll_interval)
+            for pin, sequence in sequences.items():
+                current = self.backend.sequence(pin)
+                if current == sequence:
+                    continue
+                sequences[pin] = current
+                value = self.backend.read(pin)
+                with self.clients_lock:
+                    clients = list(self.clients)
+                for connection in clients:
+                    self.send(connection, {'pin': pin, 'value': value})
+
+
+class MockClient:
+    def __init__(self, path=DEFAULT_PATH, on_change=None):
+        self.on_change = on_change
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.connect(path)
+        self.lines = self.connection.makefile('r', encoding='utf-8')
+        hello = json.loads(self.lines.readline())
+        self.channels = hello['channels']
+        self.values = hello['values']
+        self.changes = 0
+        self.condition = Condition()
+        self.thread = Thread(target=self.receive_loop, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    def channels_of_type(self, *types):
+        return [channel for channel in self.channels if channel['type'] in types]
+
+    def set(self, pin, value):
+        self.connection.sendall((json.dumps({'set': pin, 'value': float(value)}) + '\n').encode('utf-8'))
+
+    def wait_for(self, pin, predicate, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: predicate(self.values.get(pin)), timeout=timeout)
+
+    def receive_loop(self):
+        try:
+            for line in self.lines:
+                message = json.loads(line)
+                with self.condition:
+                    self.values[message['pin']] = message['value']
+                    self.changes += 1
+                    self.condition.notify_all()
+                if self.on_change is not None:
+                    self.on_change(message['pin'], message['value'])
+        except (OSError, ValueError):
+            pass
+
+    def close(self):
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+
+
+def drive(client, duration, rate=50.0, seed=None):
+    """Random walks all analog inputs and toggles the switches now and then, e.g. for load tests"""
+    rng = random.Random(seed)
+    analog = {channel['pin']: client.values[channel['pin']] for channel in client.channels_of_type('adc')}
+    switches = [channel['pin'] for channel in client.channels_of_type('switch')]
+    sent = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        for pin in analog:
+            analog[pin] = min(max(analog[pin] + rng.gauss(0.0, 0.02), 0.0), 1.0)
+            client.set(pin, analog[pin])
+            sent += 1
+        if switches and rng.random() < 0.01:
+            pin = rng.choice(switches)
+            client.set(pin, 0.0 if client.values.get(pin) else 1.0)
+            sent += 1
+        time.sleep(1.0 / rate)
+    return sent
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the mocked devices of a level file')
+    parser.add_argument('levels', nargs='?', default='levels.json')
+    parser.add_argument('--socket', default=DEFAULT_PATH)
+    parser.add_argument('--drive', type=float, metavar='SECONDS', help='drive all inputs randomly for this long')
+    parser.add_argument('--rate', type=float, default=50.0, help='input updates per second while driving')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    server = MockServer(load_levels(args.levels), path=args.socket)
+    server.start()
+    print('Serving %d mocked devices on %s' % (len(server.channels), args.socket))
+    try:
+        if args.drive:
+            client = MockClient(args.socket)
+            start = time.monotonic()
+            sent = drive(client, args.drive, rate=args.rate, seed=args.seed)
+            print('Sent %d updates, received %d changes in %.1f s' % (sent, client.changes, time.monotonic() - start))
+        else:
+            while True:
+                time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    server.stop()
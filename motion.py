@@ -0,0 +1,160 @@
+"""This module plans servo movements on a fixed rate tick instead of writing every new angle right away.
+
+Setting the angle of a planned servo only changes its target. The controller thread moves every servo towards its
+target with limited velocity and acceleration and writes the duty cycles of one tick together. Scripted moves,
+e.g. the eject kick, are stepped by the same tick, so nobody has to sleep for them.
+"""
+import math
+import time
+from threading import Thread, Condition, Event
+
+from hardware import outputs
+
+
+class ServoMotion:
+    def __init__(self, servo, controller, max_velocity=2.0, max_acceleration=20.0, smoothing=0.0, deadband=None):
+        """Velocities are in full ranges per second, smoothing is the time constant of the target low pass"""
+        self.servo = servo
+        self.controller = controller
+        self.max_velocity = max_velocity
+        self.max_acceleration = max_acceleration
+        self.smoothing = smoothing
+        # Input jitter is filtered here now, the servo itself has to follow every planned step
+        self.movement_threshold = servo.movement_threshold if deadband is None else deadband
+        servo.movement_threshold = 0.0
+        self.position = servo.angle
+        self.velocity = 0.0
+        self.target = self.position
+        self.smoothed_target = self.position
+        self.script = []
+        self.script_deadline = None
+        self.script_done = None
+
+    def __getattr__(self, attribute):
+        return getattr(self.servo, attribute)
+
+    @property
+    def angle(self):
+        return self.position
+
+    @angle.setter
+    def angle(self, value):
+        if abs(value - self.target) > self.movement_threshold:
+            self.controller.set_target(self, value)
+
+    @property
+    def idle(self):
+        return (not self.script and self.script_done is None and self.velocity == 0.0 and
+                self.position == self.target and self.smoothed_target == self.target)
+
+    def play(self, script):
+        """Moves through a list of (angle, seconds) without blocking, the returned Event is set when done"""
+        return self.controller.play(self, script)
+
+    def step(self, now, dt):
+        if self.script and (self.script_deadline is None or now >= self.script_deadline):
+            angle, duration = self.script.pop(0)
+            self.target = angle
+            self.script_deadline = now + duration
+        if not self.script and self.script_done is not None and now >= self.script_deadline:
+            self.script_done.set()
+            self.script_done = None
+
+        if self.smoothing > 0.0:
+            self.smoothed_target += (self.target - self.smoothed_target) * (1.0 - math.exp(-dt / self.smoothing))
+            if abs(self.target - self.smoothed_target) < 1e-4:
+                self.smoothed_target = self.target
+        else:
+            self.smoothed_target = self.target
+
+        error = self.smoothed_target - self.position
+        # Fastest speed from which the servo can still brake in time
+        speed = min(self.max_velocity, math.sqrt(2.0 * self.max_acceleration * abs(error)))
+        desired = math.copysign(speed, error)
+        max_change = self.max_acceleration * dt
+        self.velocity += min(max(desired - self.velocity, -max_change), max_change)
+        position = self.position + self.velocity * dt
+        if (self.smoothed_target - position) * error <= 0.0:
+            # Arrived, the braking ramp makes sure this happens at (nearly) zero speed
+            position = self.smoothed_target
+            self.velocity = 0.0
+        self.position = min(max(position, 0.0), 1.0)
+        self.servo.angle = self.position
+
+
+class MotionController:
+    def __init__(self, rate=50.0, idle_timeout=1.0):
+        self.period = 1.0 / rate
+        self.idle_timeout = idle_timeout
+        self.motions = []
+        self.condition = Condition()
+        self.running = False
+        self.thread = None
+
+    def attach(self, servo, **limits):
+        motion = ServoMotion(servo, self, **limits)
+        with self.condition:
+            self.motions.append(motion)
+        self.start()
+        return motion
+
+    def set_target(self, motion, angle):
+        with self.condition:
+            motion.target = min(max(angle, 0.0), 1.0)
+            self.condition.notify()
+
+    def play(self, motion, script):
+        done = Event()
+        if not script:
+            done.set()
+            return done
+        with self.condition:
+            if motion.script_done is not None:
+                motion.script_done.set()
+            motion.script = list(script)
+            motion.script_deadline = None
+            motion.script_done = done
+            self.condition.notify()
+        return done
+
+    def update(self, now, dt):
+        with self.condition:
+            moving = [motion for motion in self.motions if not motion.idle]
+            with outputs:
+                for motion in moving:
+                    motion.step(now, dt)
+        return len(moving)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = Thread(target=self.update_loop, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def update_loop(self):
+        last = time.monotonic()
+        while self.running:
+            now = time.monotonic()
+            # A late tick must not turn into a jump
+            moving = self.update(now, min(now - last, 2 * self.period))
+            last = now
+            if moving:
+                time.sleep(self.period)
+                continue
+            with self.condition:
+                if self.running and all(motion.idle for motion in self.motions):
+                    self.condition.wait(timeout=self.idle_timeout)
+            last = time.monotonic() - self.period
+
+
+motion = MotionController()
@@ -0,0 +1,138 @@
+"""This module provides per state timing instrumentation with HDR style latency histograms.
+
+Histograms keep a fixed relative precision (5 significant bits, about 3 %) from microseconds to hours in
+a sparse dict of buckets, so recording is cheap and memory stays small. Results can be exported on a
+signal or through a UNIX socket.
+"""
+import json
+import os
+import signal
+import socket
+from threading import Thread, Lock
+
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+
+def bucket_index(value):
+    if value < SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return SUB_BUCKETS + shift * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+
+
+def bucket_value(index):
+    """Lower bound of the values counted in a bucket"""
+    if index < SUB_BUCKETS:
+        return index
+    shift, sub_bucket = divmod(index - SUB_BUCKETS, SUB_BUCKETS)
+    return (SUB_BUCKETS + sub_bucket) << shift
+
+
+class Histogram:
+    def __init__(self, unit=1e-6):
+        self.unit = unit
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        index = bucket_index(max(0, int(seconds / self.unit)))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0.0
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(bucket_value(index) * self.unit, self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'min': self.min, 'max': self.max,
+                'p50': self.percentile(50), 'p90': self.percentile(90), 'p99': self.percentile(99),
+                'p999': self.percentile(99.9)}
+
+
+class Profiler:
+    metrics = ('dwell', 'condition_evaluation', 'parallel_iteration', 'transition_latency', 'adc_read')
+
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}
+        self.lock = Lock()
+        # Time the last transition was decided, until the next state is entered
+        self.transition_started = None
+
+    def record(self, section, metric, seconds):
+        with self.lock:
+            histogram = self.histograms.get((section, metric))
+            if histogram is None:
+                histogram = self.histograms[(section, metric)] = Histogram()
+            histogram.record(seconds)
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def export(self):
+        with self.lock:
+            result = {}
+            for (section, metric), histogram in sorted(self.histograms.items()):
+                result.setdefault(section, {})[metric] = histogram.to_dict()
+            return result
+
+    def dump(self, path):
+        with open(path, 'w') as fh:
+            json.dump(self.export(), fh, indent=2)
+
+    def install_signal_handler(self, path='profile.json', signum=signal.SIGUSR1):
+        """Dumps the histograms to path whenever the process receives signum, e.g. kill -USR1 <pid>"""
+        def handler(received, frame):
+            # The interrupted thread may hold the lock in record(), so the dump waits for it in its own thread
+            thread = Thread(target=self.dump, args=(path,))
+            thread.daemon = True
+            thread.start()
+        signal.signal(signum, handler)
+
+    def serve(self, path='/tmp/hatgame_profile.sock'):
+        """Answers every connection to the UNIX socket with the current histograms as JSON"""
+        if os.path.exists(path):
+            os.remove(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(1)
+        thread = Thread(target=self.serve_loop, args=(server,))
+        thread.daemon = True
+        thread.start()
+        return server
+
+    def serve_loop(self, server):
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                break
+            with connection:
+                try:
+                    connection.sendall(json.dumps(self.export()).encode('utf-8'))
+                except OSError:
+                    pass
+
+
+profiler = Profiler()
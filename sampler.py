@@ -0,0 +1,119 @@
+"""This module provides a shared background sampler for the analog inputs"""
+import time
+from threading import Thread, Lock, Condition
+
+
+class RingBuffer:
+    def __init__(self, size):
+        self.size = size
+        self._data = [0.0] * size
+        self._index = 0
+        self._count = 0
+        self._sum = 0.0
+
+    def append(self, value):
+        if self._count == self.size:
+            self._sum -= self._data[self._index]
+        else:
+            self._count += 1
+        self._data[self._index] = value
+        self._sum += value
+        self._index = (self._index + 1) % self.size
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def latest(self):
+        if not self._count:
+            raise IndexError('Ring buffer is empty')
+        return self._data[self._index - 1]
+
+    def mean(self, samples=None):
+        if not self._count:
+            raise IndexError('Ring buffer is empty')
+        if samples is None or samples >= self._count:
+            return self._sum / self._count
+        return sum(self.last(samples)) / samples
+
+    def last(self, samples):
+        samples = min(samples, self._count)
+        start = self._index - samples
+        if start >= 0:
+            return self._data[start:self._index]
+        return self._data[start:] + self._data[:self._index]
+
+
+class ADCSampler:
+    def __init__(self, rate=500.0, buffer_size=100, change_threshold=0.005):
+        self.period = 1.0 / rate
+        self.buffer_size = buffer_size
+        self.change_threshold = change_threshold
+        self.channels = []
+        self.lock = Lock()
+        self.changed = Condition()
+        self.generation = 0
+        self.running = False
+        self.thread = None
+
+    def register(self, device, read_function, buffer_size=None):
+        buffer = RingBuffer(buffer_size or self.buffer_size)
+        with self.lock:
+            # The last entry holds the value the subscribers were last notified about
+            self.channels.append([device, read_function, buffer, None])
+        return buffer
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = Thread(target=self.sample_loop, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def sample_once(self):
+        with self.lock:
+            channels = list(self.channels)
+        changed = False
+        for channel in channels:
+            device, read_function, buffer, notified_value = channel
+            try:
+                value = read_function()
+            except IOError:
+                print('Sampler could not read %s' % device.pin)
+                continue
+            buffer.append(value)
+            # Compare what readers of the device will see, e.g. the average for averaged channels
+            value = device.value
+            if notified_value is None or abs(value - notified_value) > self.change_threshold:
+                channel[3] = value
+                changed = True
+        if changed:
+            with self.changed:
+                self.generation += 1
+                self.changed.notify_all()
+
+    def wait_for_change(self, timeout=None, since=None):
+        """Blocks until any channel moved by more than change_threshold or the timeout expired.
+        Pass the generation seen before evaluating the inputs as since to not miss changes in between."""
+        with self.changed:
+            generation = self.generation if since is None else since
+            return self.changed.wait_for(lambda: self.generation != generation, timeout=timeout)
+
+    def sample_loop(self):
+        next_sample = time.monotonic()
+        while self.running:
+            self.sample_once()
+            next_sample += self.period
+            delay = next_sample - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Fell behind, don't try to catch up with a burst of reads
+                next_sample = time.monotonic()
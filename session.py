@@ -0,0 +1,120 @@
+"""This module runs several game stations from one process.
+
+Every GameSession owns its devices, level table, sound channel and current state. A SessionScheduler runs all
+sessions as asyncio tasks on one or a few worker threads, the ADC sampler and the sound mixer are shared.
+"""
+import asyncio
+import random
+from threading import Thread
+
+from async_game import AsyncGame
+from helpers import SoundChannel
+from levels import load_levels
+from mixer import SoundEngine
+from mock_backend import MockBackend
+from sampler import ADCSampler
+
+
+class GameSession:
+    def __init__(self, name, levels_file='levels.json', sampler=None, engine=None, mock_hardware=False,
+                 backend=None, debug=False, seed=None):
+        self.name = name
+        self.levels = load_levels(levels_file)
+        if mock_hardware and backend is None:
+            # Each mocked station gets its own pins
+            backend = MockBackend(path='hardware_files/%s.bin' % name)
+        self.backend = backend
+        self.devices = self.levels.registry(mock_hardware=mock_hardware, sampler=sampler, backend=backend)
+        self.states = self.levels.build_states(self.devices, debug=debug)
+        self.wiring = self.levels.build_wiring(self.devices)
+        self.sound = SoundChannel(engine) if engine is not None else None
+        self.game = AsyncGame(self.states, wiring=self.wiring.update, sound=self.sound,
+                              wiring_interval=1.0 / self.levels.wiring_rate, rng=random.Random(seed))
+        self.future = None
+
+    @property
+    def current_state(self):
+        return self.game.current_state
+
+    @property
+    def running(self):
+        return self.future is not None and not self.future.done()
+
+    def __repr__(self):
+        state = self.current_state.name if self.current_state is not None else 'not started'
+        return '<GameSession %s: %s>' % (self.name, state)
+
+
+class SessionScheduler:
+    def __init__(self, workers=1, sample_rate=500.0, soundfolder=None, sink=None):
+        self.sampler = ADCSampler(rate=sample_rate)
+        self.engine = SoundEngine(soundfolder, sink=sink) if soundfolder is not None else None
+        self.sessions = []
+        self.loops = []
+        self.threads = []
+        for index in range(workers):
+            loop = asyncio.new_event_loop()
+            thread = Thread(target=self.worker, args=(loop,), name='session-worker-%d' % index)
+            thread.daemon = True
+            self.loops.append(loop)
+            self.threads.append(thread)
+
+    @staticmethod
+    def worker(loop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def add(self, name, levels_file='levels.json', **options):
+        """Creates a session on the shared sampler and mixer, it is started right away if the scheduler runs"""
+        session = GameSession(name, levels_file=levels_file, sampler=self.sampler, engine=self.engine, **options)
+        self.sessions.append(session)
+        if self.threads[0].is_alive():
+            self.schedule(session)
+        return session
+
+    def schedule(self, session, start_state=0):
+        # Round robin, sessions spend nearly all their time sleeping on their loop
+        loop = self.loops[self.sessions.index(session) % len(self.loops)]
+        session.future = asyncio.run_coroutine_threadsafe(session.game.event_loop(start_state), loop)
+
+    def start(self):
+        if self.engine is not None:
+            self.engine.start()
+        self.sampler.start()
+        for thread in self.threads:
+            thread.start()
+        for session in self.sessions:
+            self.schedule(session)
+
+    @staticmethod
+    async def cancel_tasks():
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self):
+        for loop, thread in zip(self.loops, self.threads):
+            if thread.is_alive():
+                # Let the sessions clean up on their own loop before it stops
+                asyncio.run_coroutine_threadsafe(self.cancel_tasks(), loop).result(timeout=1.0)
+                loop.call_soon_threadsafe(loop.stop)
+                thread.join(timeout=1.0)
+        self.sampler.stop()
+        if self.engine is not None:
+            self.engine.shutdown()
+
+    def run(self):
+        self.start()
+        try:
+            for thread in self.threads:
+                thread.join()
+        except KeyboardInterrupt:
+            self.stop()
+
+
+if __name__ == '__main__':
+    scheduler = SessionScheduler(workers=1)
+    for station in range(4):
+        scheduler.add('station_%d' % station, mock_hardware=True)
+    scheduler.run()
@@ -0,0 +1,140 @@
+"""This module provides a deterministic simulation of a level table running faster than real time.
+
+The states are driven by a simulated clock, a seeded random generator and scripted inputs instead of
+the hardware. Enter, leave, parallel and random actions are not run, only the transitions are logged.
+"""
+import copy
+import random
+from bisect import bisect_right
+from collections import namedtuple
+
+from conditions import AnalogCondition, DigitalCondition, CompiledCondition, IS, all_fulfilled
+
+Transition = namedtuple('Transition', ['time', 'from_state', 'to_state', 'reason'])
+
+
+class SimClock:
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    advance = sleep
+
+
+class SimulatedInput:
+    """Input holding each scripted value from its timestamp on, stands in for an ADC or a Switch.
+
+    Digital inputs read as bools like a Switch, scripted values are truth tested.
+    """
+    def __init__(self, pin, clock, points=None, digital=False):
+        self.pin = pin
+        self.clock = clock
+        self.digital = digital
+        self.times = []
+        self.values = []
+        for timestamp, value in sorted(points or []):
+            self.times.append(timestamp)
+            self.values.append(value)
+
+    def set(self, value):
+        """Changes the value from the current simulated time on"""
+        now = self.clock.time()
+        while self.times and self.times[-1] >= now:
+            self.times.pop()
+            self.values.pop()
+        self.times.append(now)
+        self.values.append(value)
+
+    @property
+    def value(self):
+        index = bisect_right(self.times, self.clock.time()) - 1
+        value = self.values[index] if index >= 0 else 0.0
+        return bool(value) if self.digital else value
+
+
+class Simulation:
+    def __init__(self, states, inputs=None, seed=None, tick=0.01, poll_interval=0.1, driver=None):
+        """inputs maps pin names to lists of (time, value) points, driver(simulation, state_key, state)
+        is called every tick and may change inputs, e.g. to model a player"""
+        self.clock = SimClock()
+        self.rng = random.Random(seed)
+        self.tick = tick
+        self.poll_interval = poll_interval
+        self.driver = driver
+        self.inputs = {}
+        for pin, points in (inputs or {}).items():
+            self.inputs[pin] = SimulatedInput(pin, self.clock, points)
+        self.states = {key: self.bind(state) for key, state in states.items()}
+        self.log = []
+
+    def input(self, pin, digital=False):
+        if pin not in self.inputs:
+            self.inputs[pin] = SimulatedInput(pin, self.clock)
+        if digital:
+            self.inputs[pin].digital = True
+        return self.inputs[pin]
+
+    def bind(self, state):
+        # Work on copies, the level table itself stays wired to the hardware
+        state = copy.copy(state)
+        conditions = []
+        for condition in state.conditions:
+            if isinstance(condition, AnalogCondition):
+                condition = copy.copy(condition)
+                condition.adc = self.input(condition.adc.pin)
+                condition.clock = self.clock.time
+                condition.debug = False
+                condition.reset()
+            elif isinstance(condition, DigitalCondition):
+                condition = copy.copy(condition)
+                condition.switch = self.input(condition.switch.pin, digital=True)
+            elif isinstance(condition, CompiledCondition):
+                switches = [instruction[1] for instruction in condition.program if instruction[0] == IS]
+                condition = condition.rebind({device: self.input(device.pin, digital=device in switches)
+                                              for device in condition.devices}, clock=self.clock.time)
+            conditions.append(condition)
+        state.conditions = conditions
+        return state
+
+    @staticmethod
+    def is_final(state):
+        return state.next_states[1] == 99
+
+    def run(self, start_state=0, max_time=3600.0):
+        """Runs until a final state is entered or max_time simulated seconds passed, returns the transition log"""
+        current = start_state
+        next_roll = self.clock.time() + self.poll_interval
+        while self.clock.time() < max_time:
+            state = self.states[current]
+            if self.is_final(state):
+                break
+            if self.driver is not None:
+                self.driver(self, current, state)
+            next_state, reason = None, None
+            if all_fulfilled(state.conditions):
+                next_state, reason = state.next_states[0], 'condition'
+            elif self.clock.time() >= next_roll:
+                # fail_probability is given per poll interval, like in State.run
+                next_roll += self.poll_interval
+                if self.rng.random() < state.fail_probability:
+                    next_state, reason = state.next_states[1], 'random'
+            if next_state is not None:
+                self.log.append(Transition(self.clock.time(), current, next_state, reason))
+                current = next_state
+            self.clock.advance(self.tick)
+        return self.log
+
+    @property
+    def state_times(self):
+        """Time spent in each state visit as (state, seconds) pairs"""
+        times = []
+        entered = 0.0
+        for transition in self.log:
+            times.append((transition.from_state, transition.time - entered))
+            entered = transition.time
+        return times
@@ -0,0 +1,103 @@
+"""This module provides low overhead diagnostics for the hardware hot paths.
+
+Recording an event only appends a tuple to a bounded ring, rendering to JSON lines and writing happen
+in a background thread. Per device counters are dict increments under a lock, as the sampler, the wiring
+and the states count from their own threads.
+"""
+import itertools
+import json
+import sys
+import time
+from collections import deque
+from threading import Thread, Event, Lock
+
+
+class Telemetry:
+    def __init__(self, capacity=4096, sink=sys.stdout, flush_interval=0.5, sampling=None):
+        """sampling maps event kinds to n, of which only every n-th event is recorded"""
+        self.events = deque(maxlen=capacity)
+        self.sink = sink
+        self.flush_interval = flush_interval
+        self.sampling = dict(sampling or {})
+        self.counters = {}
+        self.enabled = True
+        self._sequences = {}
+        self._flushed = 0
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._stop = Event()
+        self.thread = None
+
+    def count(self, device, name, increment=1):
+        key = (device, name)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + increment
+
+    def event(self, kind, **fields):
+        if not self.enabled:
+            return
+        every = self.sampling.get(kind)
+        if every:
+            with self._lock:
+                sequence = self._sequences.get(kind)
+                if sequence is None:
+                    sequence = self._sequences[kind] = itertools.count()
+                skip = next(sequence) % every
+            if skip:
+                return
+        # deque.append is atomic, a full ring silently drops its oldest event
+        self.events.append((time.time(), kind, fields))
+        if self.thread is None and self.sink is not None:
+            self.start()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self._stop.clear()
+        self.thread = Thread(target=self.flush_loop, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        self.flush()
+
+    def flush(self):
+        if self.sink is None:
+            return
+        # stop() may flush while the flush thread does, the lines of both must not interleave
+        with self._flush_lock:
+            lines = []
+            while True:
+                try:
+                    timestamp, kind, fields = self.events.popleft()
+                except IndexError:
+                    break
+                record = {'time': round(timestamp, 4), 'kind': kind}
+                record.update(fields)
+                lines.append(json.dumps(record))
+            if lines:
+                self._flushed += len(lines)
+                self.sink.write('\n'.join(lines) + '\n')
+                self.sink.flush()
+
+    def flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except (IOError, ValueError) as error:
+                print('Telemetry could not flush: %s' % error)
+
+    def snapshot(self):
+        """Counters and the events still waiting in the ring, e.g. when there is no sink"""
+        with self._lock:
+            counters = {'%s.%s' % key: value for key, value in self.counters.items()}
+        return {'counters': counters,
+                'events': [dict(fields, time=timestamp, kind=kind) for timestamp, kind, fields in list(self.events)],
+                'flushed': self._flushed}
+
+
+telemetry = Telemetry(sampling={'condition': 10})
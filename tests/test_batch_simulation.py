@@ -0,0 +1,30 @@
+from batch_simulation import SeekingPlayer, run_batch
+from levels import LevelTable
+from simulation import Simulation
+
+
+def switch_level_table():
+    return LevelTable({
+        'devices': {'button': {'type': 'switch', 'pin': 'P9_30'}, 'knob': {'type': 'adc', 'pin': 'AIN1'}},
+        'states': [
+            {'id': 0, 'name': 'Press', 'condition': {'type': 'digital', 'input': 'button'}, 'next_states': [1, 1]},
+            {'id': 1, 'name': 'Turn', 'condition': {'type': 'analog', 'input': 'knob', 'condition': 'bigger',
+                                                    'threshold': 0.3, 'hold_true': 0.5},
+             'next_states': [2, 2]},
+            {'id': 2, 'name': 'Done', 'condition': False, 'next_states': [2, 99]},
+        ],
+    }).build_states()
+
+
+def test_player_presses_switches():
+    simulation = Simulation(switch_level_table(), seed=3, driver=SeekingPlayer(reaction_time=(0.1, 0.2)))
+    log = simulation.run(max_time=60.0)
+    assert [transition.to_state for transition in log] == [1, 2]
+    assert simulation.inputs['P9_30'].value is True
+
+
+def test_batch_report_is_reproducible():
+    first = run_batch(switch_level_table, games=8, seed=5, workers=2, max_time=60.0, chunk_size=4)
+    second = run_batch(switch_level_table, games=8, seed=5, workers=2, max_time=60.0, chunk_size=4)
+    assert first == second
+    assert first['completed'] == 8
@@ -0,0 +1,100 @@
+import pytest
+
+from conditions import (Above, Below, Within, Is, All, Any, Not, Hold, AnalogCondition, DigitalCondition,
+                        all_fulfilled)
+
+
+class Input:
+    def __init__(self, value):
+        self.value = value
+        self.reads = 0
+
+    def __getattribute__(self, attribute):
+        if attribute == 'value':
+            object.__setattr__(self, 'reads', object.__getattribute__(self, 'reads') + 1)
+        return object.__getattribute__(self, attribute)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_leaves():
+    knob, switch = Input(0.5), Input(True)
+    assert Above(knob, 0.4).compile()
+    assert not Below(knob, 0.4).compile()
+    assert Within(knob, 0.52, 0.05).compile()
+    assert not Within(knob, 0.6, 0.05).compile()
+    assert Is(switch).compile()
+    assert not Is(switch, on=False).compile()
+
+
+def test_combinators():
+    knob, switch = Input(0.5), Input(False)
+    assert (Above(knob, 0.4) & ~Is(switch)).compile()
+    assert not (Above(knob, 0.4) & Is(switch)).compile()
+    assert (Below(knob, 0.4) | Any(Is(switch), Within(knob, 0.5, 0.1))).compile()
+    assert All(Above(knob, 0.1), Above(knob, 0.2), Above(knob, 0.3)).compile()
+    assert not Not(All(Above(knob, 0.1), Above(knob, 0.2))).compile()
+
+
+def test_nested_combinators_keep_the_stack():
+    knob = Input(0.5)
+    condition = All(Any(Below(knob, 0.1), Above(knob, 0.4)), Not(Below(knob, 0.1)), Above(knob, 0.2)).compile()
+    assert condition
+    knob.value = 0.3
+    assert not condition
+
+
+@pytest.mark.parametrize('combinator', [All, Any])
+def test_empty_combinators_are_rejected(combinator):
+    with pytest.raises(ValueError):
+        combinator().compile()
+    with pytest.raises(ValueError):
+        All(Above(Input(0.5), 0.1), combinator()).compile()
+
+
+def test_every_input_is_read_once():
+    knob = Input(0.5)
+    condition = (Above(knob, 0.1) & Below(knob, 0.9) & Within(knob, 0.5, 0.1)).compile()
+    assert condition
+    assert knob.reads == 1
+
+
+def test_hold():
+    clock, knob = Clock(), Input(0.5)
+    condition = Hold(Above(knob, 0.4), 2.0).compile(clock=clock)
+    assert not condition
+    clock.now = 1.0
+    assert not condition
+    assert condition.time_until_hold() == pytest.approx(1.0)
+    clock.now = 2.0
+    assert condition
+    assert condition.time_until_hold() is None
+    knob.value = 0.1
+    assert not condition
+    knob.value = 0.5
+    clock.now = 3.0
+    assert not condition
+
+
+def test_rebind():
+    knob, other = Input(0.5), Input(0.1)
+    condition = Above(knob, 0.4).compile()
+    rebound = condition.rebind({knob: other})
+    assert condition and not rebound
+
+
+def test_all_fulfilled_takes_one_snapshot():
+    knob, switch = Input(0.5), Input(True)
+    conditions = [AnalogCondition(knob, threshold=0.4), DigitalCondition(switch),
+                  (Above(knob, 0.1) & Is(switch)).compile(), True]
+    assert all_fulfilled(conditions)
+    assert knob.reads == 1 and switch.reads == 1
+    assert not all_fulfilled(conditions + [False])
+    switch.value = False
+    assert not all_fulfilled(conditions)
@@ -0,0 +1,37 @@
+import pytest
+
+from filters import MovingAverage, ExponentialMovingAverage, RollingMedian
+from hardware import ADC
+
+
+class Backend:
+    def __init__(self):
+        self.values = {}
+        self.reads = 0
+
+    def read(self, pin):
+        self.reads += 1
+        return self.values.get(pin, 0.0)
+
+    def write(self, pin, value):
+        self.values[pin] = value
+
+
+@pytest.mark.parametrize('sample_filter', [MovingAverage(100), RollingMedian(25), ExponentialMovingAverage(0.5)])
+def test_filtered_read_without_sampler_follows_a_change(sample_filter):
+    backend = Backend()
+    adc = ADC('AIN4', mock_hardware=True, sample_filter=sample_filter, backend=backend)
+    backend.write('AIN4', 0.2)
+    assert adc.value == pytest.approx(0.2)
+    backend.write('AIN4', 0.6)
+    # The EMA has followed three quarters of the step after its span
+    assert adc.value == pytest.approx(0.6, abs=0.11)
+    assert backend.reads == 2 * sample_filter.span
+
+
+def test_average_samples_without_sampler():
+    backend = Backend()
+    backend.write('AIN1', 0.4)
+    adc = ADC('AIN1', average_samples=8, mock_hardware=True, backend=backend)
+    assert adc.value == pytest.approx(0.4)
+    assert backend.reads == 8
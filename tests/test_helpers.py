@@ -0,0 +1,127 @@
+import time
+from queue import Empty
+from threading import Thread
+
+import pytest
+
+from helpers import SoundQueue, ResonanceBand, cavity_resonant_blinking, cavity_lightfield_1, cavity_lightfield_2
+from mixer import INSULT_PRIORITY, STAGE_PRIORITY
+
+
+def test_highest_priority_first_then_in_order():
+    queue = SoundQueue()
+    queue.put('I1.wav')
+    queue.put('I2.wav')
+    queue.put('S1.wav', priority=STAGE_PRIORITY)
+    assert [queue.get(block=False) for _ in range(3)] == ['S1.wav', 'I1.wav', 'I2.wav']
+    with pytest.raises(Empty):
+        queue.get(block=False)
+
+
+def test_queued_sounds_are_coalesced():
+    queue = SoundQueue()
+    queue.put('I1.wav')
+    queue.put('I2.wav')
+    queue.put('I1.wav', priority=STAGE_PRIORITY)
+    assert queue.qsize() == 2
+    assert queue.coalesced == 1
+    assert queue.get(block=False) == 'I1.wav'
+
+
+def test_full_queue_drops_the_lowest_priority():
+    queue = SoundQueue(maxsize=2)
+    assert queue.put('I1.wav')
+    assert queue.put('I2.wav')
+    assert not queue.put('I3.wav')
+    assert queue.put('S1.wav', priority=STAGE_PRIORITY)
+    assert queue.dropped_full == 2
+    # Within a priority the newest sound makes room, the older one has been waiting longer
+    assert [queue.get(block=False) for _ in range(2)] == ['S1.wav', 'I1.wav']
+
+
+def test_stale_sounds_are_dropped():
+    queue = SoundQueue()
+    queue.put('I1.wav', deadline=0.01)
+    queue.put('S1.wav', priority=STAGE_PRIORITY)
+    queue.get(block=False)
+    time.sleep(0.02)
+    with pytest.raises(Empty):
+        queue.get(block=False)
+    assert queue.dropped_stale == 1
+
+
+def test_clear_keeps_higher_priorities():
+    queue = SoundQueue()
+    queue.put('I1.wav')
+    queue.put('S1.wav', priority=STAGE_PRIORITY)
+    queue.clear(max_priority=INSULT_PRIORITY)
+    assert queue.qsize() == 1
+
+
+def test_get_times_out():
+    queue = SoundQueue()
+    started = time.monotonic()
+    with pytest.raises(Empty):
+        queue.get(timeout=0.05)
+    assert time.monotonic() - started >= 0.05
+
+
+def test_close_wakes_up_a_waiting_get():
+    queue = SoundQueue()
+    errors = []
+
+    def get():
+        try:
+            queue.get()
+        except Empty as error:
+            errors.append(error)
+
+    thread = Thread(target=get)
+    thread.start()
+    time.sleep(0.05)
+    queue.close()
+    thread.join(timeout=1.0)
+    assert not thread.is_alive()
+    assert len(errors) == 1
+    assert not queue.put('I1.wav')
+
+
+def scan(band, reading):
+    """The lookup by scanning every resonance, which the band replaces"""
+    steps = [band.offset + step * band.spacing for step in range(band.count)]
+    return any(abs(reading - step) < band.epsilon for step in steps)
+
+
+@pytest.mark.parametrize('band', [cavity_lightfield_1, cavity_lightfield_2,
+                                  ResonanceBand(spacing=0.05, offset=0.01, count=20, epsilon=0.01)])
+def test_resonance_band_matches_a_scan(band):
+    readings = [index / 1000.0 for index in range(-100, 2100)]
+    assert [band.lit(reading) for reading in readings] == [scan(band, reading) for reading in readings]
+    assert band.lit_many(readings[:50]) == [scan(band, reading) for reading in readings[:50]]
+
+
+def test_resonance_band_edges():
+    band = ResonanceBand(spacing=0.2, offset=0.1, count=3, epsilon=0.02)
+    assert band.lit(0.1) and band.lit(0.5) and band.lit(0.515)
+    assert not band.lit(0.52)
+    # Beyond the last resonance nothing is lit, however far out
+    assert not band.lit(0.7)
+    assert band.lit_any([0.0, 0.3, 0.31])
+    assert not band.lit_any([0.0, 0.2])
+
+
+class Output:
+    state = None
+
+
+class Reading:
+    def __init__(self, value):
+        self.value = value
+
+
+def test_cavity_resonant_blinking():
+    led_0, led_1 = Output(), Output()
+    cavity_resonant_blinking(led_0, led_1, Reading(0.36))
+    assert (led_0.state, led_1.state) == (True, False)
+    cavity_resonant_blinking(led_0, led_1, Reading(0.4))
+    assert (led_0.state, led_1.state) == (False, True)
@@ -0,0 +1,75 @@
+import pytest
+
+from input_trace import TraceRecorder, TraceReader, ReplayBackend, RECORD, header_size
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def record(path, samples, **options):
+    clock = Clock()
+    recorder = TraceRecorder(str(path), max_channels=4, buffer_records=2, clock=clock, **options)
+    for timestamp, pin, value in samples:
+        clock.now = 100.0 + timestamp
+        recorder.record(pin, value)
+    recorder.close()
+    return recorder
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'game.trace'
+    record(path, [(0.0, 'AIN1', 0.25), (0.5, 'P9_30', 1.0), (1.0, 'AIN1', 0.5), (2.0, 'AIN1', 0.75)])
+    reader = TraceReader(str(path))
+    try:
+        assert reader.channels == ['AIN1', 'P9_30']
+        assert len(reader) == 4
+        assert [reader[index] for index in range(len(reader))] == \
+            [(0.0, 'AIN1', 0.25), (0.5, 'P9_30', 1.0), (1.0, 'AIN1', 0.5), (2.0, 'AIN1', 0.75)]
+        assert reader.duration == 2.0
+        assert reader.seek(0.7) == 2
+        assert reader.seek(5.0) == 4
+    finally:
+        reader.close()
+
+
+def test_only_changes_are_recorded_and_replayed(tmp_path):
+    path = tmp_path / 'game.trace'
+    samples = [(0.1 * step, 'AIN1', 0.5 if step < 5 else 0.25) for step in range(10)]
+    recorder = record(path, samples)
+    assert recorder.records == 2
+    reader = TraceReader(str(path))
+    clock = Clock()
+    replay = ReplayBackend(reader, clock=clock)
+    try:
+        for timestamp, pin, value in samples:
+            clock.now = 100.0 + timestamp
+            assert replay.read(pin) == value
+    finally:
+        reader.close()
+
+
+def test_size_limit(tmp_path):
+    path = tmp_path / 'game.trace'
+    max_bytes = header_size(4) + 3 * RECORD.size
+    recorder = record(path, [(step, 'AIN1', float(step)) for step in range(10)], max_bytes=max_bytes)
+    assert recorder.records == 3
+    assert recorder.dropped == 7
+    assert path.stat().st_size == max_bytes
+
+
+def test_record_after_close_is_ignored(tmp_path):
+    recorder = record(tmp_path / 'game.trace', [(0.0, 'AIN1', 0.5)])
+    recorder.record('AIN1', 0.75)
+    assert recorder.records == 1
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.trace'
+    path.write_bytes(b'\0' * 64)
+    with pytest.raises(ValueError):
+        TraceReader(str(path))
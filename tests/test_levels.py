@@ -0,0 +1,94 @@
+import copy
+import json
+import os
+
+import pytest
+
+from conditions import CompiledCondition
+from levels import LevelTable, load_levels
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def spec():
+    return {
+        'devices': {
+            'knob': {'type': 'adc', 'pin': 'AIN1'},
+            'button': {'type': 'switch', 'pin': 'P9_30'},
+            'lamp': {'type': 'led', 'pin': 'P9_15'},
+        },
+        'states': [
+            {'id': 0, 'name': 'Turn', 'condition': {'type': 'analog', 'input': 'knob', 'condition': 'bigger',
+                                                    'threshold': 0.5},
+             'next_states': [1, 1]},
+            {'id': 1, 'name': 'Done', 'condition': False, 'next_states': [1, 99]},
+        ],
+    }
+
+
+def with_condition(condition):
+    level = spec()
+    level['states'][0]['condition'] = condition
+    return level
+
+
+def test_shipped_level_file_is_valid():
+    levels = load_levels(os.path.join(ROOT, 'levels.json'))
+    assert 0 in levels.build_states()
+
+
+def test_compiled_condition_from_level_file():
+    level = with_condition({'type': 'hold', 'seconds': 1, 'condition': {'type': 'all', 'conditions': [
+        {'type': 'within', 'input': 'knob', 'center': 0.7, 'epsilon': 0.05},
+        {'type': 'not', 'condition': {'type': 'is', 'input': 'button'}}]}})
+    condition = LevelTable(level).build_states()[0].conditions[0]
+    assert isinstance(condition, CompiledCondition)
+    assert condition.hold_times == [1]
+
+
+@pytest.mark.parametrize('change, message', [
+    (lambda level: level.pop('devices'), 'devices'),
+    (lambda level: level['devices']['knob'].update(type='dial'), 'devices.knob'),
+    (lambda level: level['devices']['knob'].update(filter={'type': 'kalman'}), 'filter'),
+    (lambda level: level['devices']['lamp'].update(motion={'max_velocity': 1.0}), 'motion'),
+    (lambda level: level['states'][0].update(id=2), 'state 0'),
+    (lambda level: level['states'][1].update(id=0), 'unique'),
+    (lambda level: level['states'][0].update(next_states=[7, 1]), 'unknown state'),
+    (lambda level: level['states'][0].update(next_states=[1]), 'next_states'),
+    (lambda level: level['states'][0].update(enter_actions=[{'action': 'dance'}]), 'unknown action'),
+    (lambda level: level.update(wiring=[{'source': 'lamp', 'target': 'lamp', 'attribute': 'state'}]), 'lamp'),
+])
+def test_invalid_level_files(change, message):
+    level = spec()
+    change(level)
+    with pytest.raises(ValueError, match=message):
+        LevelTable(level, 'broken.json')
+
+
+@pytest.mark.parametrize('condition, message', [
+    ({'type': 'analog', 'input': 'button', 'condition': 'bigger'}, 'button is no adc'),
+    ({'type': 'analog', 'input': 'knob', 'condition': 'around'}, 'condition has to be one of'),
+    ({'type': 'digital', 'input': 'knob'}, 'knob is no switch'),
+    ({'type': 'above', 'input': 'knob'}, 'threshold has to be a number'),
+    ({'type': 'within', 'input': 'knob', 'center': '0.5'}, 'center has to be a number'),
+    ({'type': 'all', 'conditions': []}, 'non empty list'),
+    ({'type': 'any', 'conditions': [{'type': 'is', 'input': 'nobody'}]}, r'conditions\[0\]\.input: unknown device'),
+    ({'type': 'not'}, r'condition\.condition: expected true, false or a condition'),
+    ({'type': 'hold', 'seconds': 'long', 'condition': {'type': 'is', 'input': 'button'}}, 'seconds'),
+    ({'type': 'sometimes'}, 'expected true, false or a condition'),
+])
+def test_invalid_conditions(condition, message):
+    with pytest.raises(ValueError, match=message):
+        LevelTable(with_condition(condition), 'broken.json')
+
+
+def test_errors_name_the_file():
+    with pytest.raises(ValueError, match='^broken.json: '):
+        LevelTable(with_condition({'type': 'sometimes'}), 'broken.json')
+
+
+def test_valid_level_file_is_left_unchanged():
+    level = spec()
+    original = copy.deepcopy(level)
+    LevelTable(level)
+    assert json.dumps(level, sort_keys=True) == json.dumps(original, sort_keys=True)
@@ -0,0 +1,89 @@
+import wave
+from array import array
+
+import pytest
+
+import mixer
+from helpers import SoundChannel
+from mixer import SoundLibrary, SoundEngine, NullSink, STAGE_PRIORITY
+
+
+def write_wav(path, frames=100, rate=8000, sampwidth=2):
+    with wave.open(str(path), 'wb') as fh:
+        fh.setnchannels(1)
+        fh.setsampwidth(sampwidth)
+        fh.setframerate(rate)
+        fh.writeframes(b'\0' * frames * sampwidth)
+
+
+def sound_folder(tmp_path):
+    for name in ('S0_intro.wav', 'S1.wav', 'S2.wav', 'S10.wav', 'S.wav', 'I1.wav', 'E1.wav'):
+        write_wav(tmp_path / name)
+    return tmp_path
+
+
+def test_stage_sounds_by_number(tmp_path):
+    library = SoundLibrary(str(sound_folder(tmp_path)))
+    assert library.stagesounds == {0: 'S0_intro.wav', 1: 'S1.wav', 2: 'S2.wav', 10: 'S10.wav'}
+    assert library.random_pool == ('I1.wav', 'E1.wav')
+
+
+def test_stage_sound_with_missing_numbers(tmp_path):
+    folder = sound_folder(tmp_path)
+    (folder / 'S1.wav').unlink()
+    library = SoundLibrary(str(folder))
+    assert library.stagesounds[2] == 'S2.wav'
+    assert 1 not in library.stagesounds
+
+
+def test_manifest_is_reused_with_skipped_files(tmp_path, capsys):
+    folder = sound_folder(tmp_path)
+    (folder / 'broken.wav').write_bytes(b'not a wave file')
+    write_wav(folder / 'S3_fast.wav', rate=44100)
+    first = SoundLibrary(str(folder))
+    assert 'broken.wav' not in first and 'S3_fast.wav' not in first
+    assert capsys.readouterr().out
+
+    second = SoundLibrary(str(folder))
+    # Nothing is scanned again, so nothing is reported again
+    assert capsys.readouterr().out == ''
+    assert second.entries == first.entries
+    assert second.format == first.format
+
+
+def test_manifest_is_rebuilt_when_a_file_changes(tmp_path):
+    folder = sound_folder(tmp_path)
+    SoundLibrary(str(folder))
+    write_wav(folder / 'S4.wav')
+    assert SoundLibrary(str(folder)).stagesounds[4] == 'S4.wav'
+
+
+def test_channel_plays_stage_sounds_by_number(tmp_path):
+    engine = SoundEngine(str(sound_folder(tmp_path)), sink=NullSink())
+    channel = SoundChannel(engine)
+    channel.play_stage_sound(10)
+    assert [voice.clip.name for voice in engine.voices] == ['S10.wav']
+    assert engine.voices[0].priority == STAGE_PRIORITY
+    channel.play_stage_sound(5)
+    assert len(engine.voices) == 1
+
+
+@pytest.mark.parametrize('sampwidth, fragments, expected', [
+    (2, [[1000, -1000, 30000], [500, -500, 10000]], [1500, -1500, 32767]),
+    (2, [[-30000], [-10000], [5]], [-32768]),
+    (1, [[128 + 10, 128 - 100], [128 + 20, 128 - 100]], [128 + 30, 0]),
+    (4, [[2 ** 31 - 10, 7], [20, -8]], [2 ** 31 - 1, -1]),
+])
+def test_mix_without_audioop(monkeypatch, sampwidth, fragments, expected):
+    pytest.importorskip('numpy')
+    monkeypatch.setattr(mixer, 'audioop', None)
+    code = {1: 'B', 2: 'h', 4: 'i'}[sampwidth]
+    mixed = mixer.mix([array(code, fragment).tobytes() for fragment in fragments], sampwidth)
+    assert array(code, mixed).tolist() == expected
+
+
+def test_mix_without_audioop_and_numpy(monkeypatch):
+    monkeypatch.setattr(mixer, 'audioop', None)
+    monkeypatch.setattr(mixer, 'np', None)
+    first, second = array('h', [1, 2]).tobytes(), array('h', [3, 4]).tobytes()
+    assert mixer.mix([first, second], 2) == first
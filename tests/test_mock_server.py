@@ -0,0 +1,47 @@
+import os
+import time
+
+from levels import LevelTable
+from mock_backend import MockBackend
+from mock_server import MockServer, MockClient
+
+
+def levels():
+    return LevelTable({
+        'devices': {'knob': {'type': 'adc', 'pin': 'AIN1'}, 'lamp': {'type': 'led', 'pin': 'P9_15'}},
+        'states': [{'id': 0, 'name': 'Done', 'condition': False, 'next_states': [0, 99]}],
+    })
+
+
+def test_set_push_and_stop(tmp_path):
+    backend = MockBackend(path=str(tmp_path / 'mock.bin'))
+    path = str(tmp_path / 'mock.sock')
+    server = MockServer(levels(), backend=backend, path=path, poll_interval=0.001)
+    server.start()
+    threads = list(server.threads)
+    client = MockClient(path)
+    try:
+        assert [channel['pin'] for channel in client.channels] == ['AIN1', 'P9_15']
+        client.set('AIN1', 0.25)
+        assert client.wait_for('AIN1', lambda value: value == 0.25, timeout=2.0)
+        assert backend.read('AIN1') == 0.25
+        backend.write('P9_15', 1.0)
+        assert client.wait_for('P9_15', lambda value: value == 1.0, timeout=2.0)
+    finally:
+        client.close()
+        started = time.monotonic()
+        server.stop()
+    assert time.monotonic() - started < 1.0
+    assert not any(thread.is_alive() for thread in threads)
+    assert not os.path.exists(path)
+    server.stop()
+
+
+def test_stop_without_clients(tmp_path):
+    path = str(tmp_path / 'mock.sock')
+    server = MockServer(levels(), backend=MockBackend(path=str(tmp_path / 'mock.bin')), path=path)
+    server.start()
+    accept_thread = server.threads[0]
+    server.stop()
+    assert not accept_thread.is_alive()
+    assert not os.path.exists(path)
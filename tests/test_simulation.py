@@ -0,0 +1,57 @@
+from levels import LevelTable
+from simulation import Simulation
+
+
+def level_table():
+    return LevelTable({
+        'hold_time': 1.0,
+        'devices': {
+            'knob': {'type': 'adc', 'pin': 'AIN1'},
+            'button': {'type': 'switch', 'pin': 'P9_30'},
+        },
+        'states': [
+            {'id': 0, 'name': 'Press', 'condition': {'type': 'digital', 'input': 'button'}, 'next_states': [1, 1]},
+            {'id': 1, 'name': 'Release', 'condition': {'type': 'digital', 'input': 'button', 'on': False},
+             'next_states': [2, 2]},
+            {'id': 2, 'name': 'Turn', 'condition': {'type': 'analog', 'input': 'knob', 'condition': 'bigger',
+                                                    'threshold': 0.5},
+             'next_states': [3, 3]},
+            {'id': 3, 'name': 'Done', 'condition': False, 'next_states': [3, 99]},
+        ],
+    })
+
+
+def test_digital_and_analog_conditions():
+    states = level_table().build_states()
+    simulation = Simulation(states, inputs={'P9_30': [(1.0, 1.0), (2.0, 0.0)], 'AIN1': [(3.0, 0.8)]}, seed=1)
+    log = simulation.run(max_time=10.0)
+
+    assert [(transition.from_state, transition.to_state, transition.reason) for transition in log] == \
+        [(0, 1, 'condition'), (1, 2, 'condition'), (2, 3, 'condition')]
+    assert abs(log[0].time - 1.0) < 0.02
+    assert abs(log[1].time - 2.0) < 0.02
+    # The analog condition has to hold for the hold_time of the level table
+    assert abs(log[2].time - 4.0) < 0.05
+
+
+def test_switch_inputs_read_as_bools():
+    simulation = Simulation(level_table().build_states(), inputs={'P9_30': [(0.0, 1.0)]})
+    assert simulation.inputs['P9_30'].value is True
+    assert simulation.inputs['AIN1'].value == 0.0
+
+
+def test_same_seed_same_log():
+    inputs = {'P9_30': [(0.5, 1.0), (0.7, 0.0)], 'AIN1': [(1.0, 0.9)]}
+    runs = [Simulation(level_table().build_states(), inputs=inputs, seed=7).run(max_time=10.0) for _ in range(2)]
+    assert runs[0] == runs[1]
+
+
+def test_compiled_condition():
+    table = level_table()
+    table.spec['states'][2]['condition'] = {'type': 'hold', 'seconds': 0.5, 'condition': {'type': 'all', 'conditions': [
+        {'type': 'above', 'input': 'knob', 'threshold': 0.5}, {'type': 'is', 'input': 'button', 'on': False}]}}
+    simulation = Simulation(table.build_states(), inputs={'P9_30': [(1.0, 1.0), (2.0, 0.0)], 'AIN1': [(3.0, 0.8)]})
+    log = simulation.run(max_time=10.0)
+    assert [transition.to_state for transition in log] == [1, 2, 3]
+    assert simulation.inputs['P9_30'].digital
+    assert abs(log[2].time - 3.5) < 0.05
@@ -0,0 +1,33 @@
+import io
+import json
+from threading import Thread
+
+from telemetry import Telemetry
+
+
+def test_counters_from_several_threads():
+    telemetry = Telemetry(sink=None)
+
+    def count():
+        for _ in range(20000):
+            telemetry.count('AIN1', 'reads')
+
+    threads = [Thread(target=count) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert telemetry.snapshot()['counters'] == {'AIN1.reads': 80000}
+
+
+def test_sampled_events_are_flushed_as_json_lines():
+    sink = io.StringIO()
+    telemetry = Telemetry(sink=sink, sampling={'condition': 10})
+    for index in range(25):
+        telemetry.event('condition', index=index)
+    telemetry.event('transition', state=1)
+    telemetry.stop()
+    records = [json.loads(line) for line in sink.getvalue().splitlines()]
+    assert [record.get('index') for record in records if record['kind'] == 'condition'] == [0, 10, 20]
+    assert records[-1]['kind'] == 'transition'
+    assert telemetry.snapshot()['flushed'] == 4
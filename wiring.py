@@ -0,0 +1,80 @@
+"""This module provides the declarative wiring of inputs to outputs, e.g. a potentiometer to a servo"""
+import time
+from threading import Thread
+
+from hardware import outputs
+
+
+class Wire:
+    def __init__(self, source, target, attribute, transform=None, deadband=None, rate=None):
+        self.source = source
+        self.target = target
+        self.attribute = attribute
+        self.transform = transform
+        if deadband is None:
+            # Servos ignore smaller movements anyway, LEDs only react to actual changes
+            deadband = getattr(target, 'movement_threshold', 0.0)
+        self.deadband = deadband
+        self.min_interval = 1.0 / rate if rate else 0.0
+        self._last_value = None
+        self._last_push = 0.0
+
+    def read(self):
+        value = self.source() if callable(self.source) else self.source.value
+        if self.transform is not None:
+            value = self.transform(value)
+        return value
+
+    def update(self, now):
+        if self.min_interval and now - self._last_push < self.min_interval:
+            return False
+        value = self.read()
+        if self._last_value is not None:
+            if isinstance(value, bool):
+                if value == self._last_value:
+                    return False
+            elif abs(value - self._last_value) <= self.deadband:
+                return False
+        setattr(self.target, self.attribute, value)
+        self._last_value = value
+        self._last_push = now
+        return True
+
+
+class Wiring:
+    def __init__(self, wires, rate=50.0, wakeup=None, idle_timeout=1.0):
+        self.wires = wires
+        self.period = 1.0 / rate
+        self.wakeup = wakeup
+        self.idle_timeout = idle_timeout
+        self.running = False
+        self.thread = None
+
+    def update(self):
+        now = time.monotonic()
+        # All outputs of one tick are written together
+        with outputs:
+            return sum(wire.update(now) for wire in self.wires)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = Thread(target=self.update_loop, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def update_loop(self):
+        while self.running:
+            generation = self.wakeup.generation if self.wakeup is not None else None
+            self.update()
+            # Rate limit first, then sleep until an input actually changed
+            time.sleep(self.period)
+            if self.wakeup is not None:
+                self.wakeup.wait_for_change(timeout=self.idle_timeout, since=generation)